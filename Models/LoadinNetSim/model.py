@@ -1,5 +1,4 @@
-import datetime
-
+import numpy as np
 import pandas as pd
 
 DATE_FORMAT = ['YYYY-MM-DD HH:mm', 'YYYY-MM-DD HH:mm:ss']
@@ -8,12 +7,21 @@ DATE_FORMAT = ['YYYY-MM-DD HH:mm', 'YYYY-MM-DD HH:mm:ss']
 class LoadModel:
     def __init__(self,meta,profile):
         #data={'start':'2015-02-01 00:00:00','resolution':15*60,'unit':'W'}
-        #profile=dataframe of load profile
+        #profile=dataframe of load profile, or the scenario_cache.ScenarioData
+        #of the profile table
         self.start=meta['start']
         self.resolution=meta['resolution']#resolution unit:min
         self.unit=meta['unit']
-        #obtain id lists
-        self.load_ids= profile.iloc[0].index[1:].to_list()
+        if isinstance(profile,pd.DataFrame):
+            #obtain id lists
+            self.load_ids= profile.iloc[0].index[1:].to_list()
+            times=pd.to_datetime(profile['Time'],dayfirst=True).to_numpy(dtype='datetime64[s]')
+            self._times=times.astype(np.int64)
+            self._values=profile.drop(['Time'],axis=1).to_numpy(dtype=np.float64)
+        else:
+            self.load_ids=list(profile.attrs)
+            self._times=profile.times
+            self._values=profile.values
         #load_ids=['Load R1','Load R2']
 
         self.loads=[
@@ -23,9 +31,10 @@ class LoadModel:
             }for i,n in enumerate(self.load_ids)
         ]
         self.data=profile
-        self.data['Time']=pd.to_datetime(self.data['Time'])#change time to 'timestamp'
+        #row of each time instance (epoch seconds) in the profile matrix
+        self._index={int(t):i for i,t in enumerate(self._times)}
+        self._start=int(pd.Timestamp(self.start).value//10**9)
         #variables for get()
-        self._data=None#the data at minutes(dataFrame)
         self._last_date=None#last time instance
         self._cache=None#load power at cache
 
@@ -36,23 +45,24 @@ class LoadModel:
         If the model uses a 15min resolution and minutes not multiple of 15,
         the next smaller multiple of 15 will be used. For example, if you
         pass ``minutes=23``, you'll get the value for ``15``.
+
+        The powers are returned as an array with one entry per load (a view
+        on the profile matrix).
         """
 
         # Trim "minutes" to multiples of "self.resolution"
         # Example: res=15, minutes=40 -> minutes == 30
         minutes = minutes // self.resolution * self.resolution
-        target_data=pd.to_datetime(self.start)+datetime.timedelta(minutes=minutes)
-        last_data=self.data['Time'].iloc[-1]
-        if target_data>last_data:
+        target_data=self._start+minutes*60
+        try:
+            row=self._index[target_data]
+        except KeyError:
             raise IndexError('Target date "%s" (%s minutes from start) '
-                             'out of range.' % (target_data, minutes))
-        else:
-            self._last_date=target_data
-            self._data=self.data[self.data['Time']==target_data]
-            just_cache=self._data.drop(['Time'],axis=1)
-            self._cache=just_cache.iloc[0]
+                             'out of range.' % (pd.to_datetime(target_data,unit='s'), minutes))
+        self._last_date=target_data
+        self._cache=self._values[row]
 
-        #return series nload_1:  1.0, load_2:    1.0
+        #return array [load_1, load_2, ...]
         return self._cache
 
 
@@ -7,6 +7,10 @@ except ModuleNotFoundError:
     import LoadinNetSim.model as Loadmodelset
 else:
     import Models.LoadinNetSim.model as Loadmodelset
+try:
+    import Models.scenario_cache as scenario_cache
+except ModuleNotFoundError:
+    import scenario_cache
 
 meta={
     'type':'time-based',
@@ -17,6 +21,7 @@ meta={
                 'sim_start', #time start(str)
                 'data_info',#data_info = {'start': '2015-02-01 00:00:00', 'resolution': 15 , 'unit': 'W'}
                 'profile_file', #profile name
+                'cache', #keep the parsed profile in the binary scenario cache (default True)
             ],
             'attrs':[],
         },
@@ -53,10 +58,14 @@ class LoadholdSim(mosaik_api.Simulator):
         self.time_resolution=float(time_resolution)
         return self.meta
 
-    def create(self, num, model, sim_start,data_info,profile_file):
+    def create(self, num, model, sim_start,data_info,profile_file,cache=True):
         if num != 1 or self.model:
             raise ValueError('Can only create one set of loads.')
-        if profile_file.endswith('csv'):
+        if cache:
+            # Attach to the shared read-only scenario store; the profile
+            # matrix is memory-mapped instead of parsed and copied again
+            pf=scenario_cache.load_profile(profile_file)
+        elif scenario_cache.base_name(profile_file).endswith('csv'):
             pf=pd.read_csv(profile_file)
         else:
             pf=pd.read_excel(profile_file)
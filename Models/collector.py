@@ -1,10 +1,12 @@
-import collections
+import time as walltime
 import pandas as pd
 import mosaik_api
 import os
-import sqlite3
-import paho.mqtt.client as mqtt
-from urllib.parse import urlparse
+
+try:
+    import Models.result_writers as result_writers
+except ModuleNotFoundError:
+    import result_writers
 META = {
     'type': 'hybrid',
     'models': {
@@ -16,29 +18,106 @@ META = {
         },
     },
 }
-#import wandb
-import sqlite3
 
 class Collector(mosaik_api.Simulator):
     def __init__(self):
         super().__init__(META)
         self.eid = None
-        self.data = collections.defaultdict(lambda: collections.defaultdict(dict))
+        self.history = None
+        self.writers = []
+        self.live_writers = []
 
     def init(self, sid, time_resolution, start_date, results_show,output_file,
              date_format='%Y-%m-%d %H:%M:%S',
              db_file='Result/result.db',
              mqtt_broker='mqtt://192.168.10.90:1883', mqtt_topic='TGVFCBB75',
-             print_results=False):
+             print_results=False, flush_steps=96, flush_interval=60, compression='zstd',
+             async_writes=False, queue_size=8, backpressure='block', spill_dir=None,
+             history=None, history_size=None, history_every=1,
+             aggregate_window=None, aggregate_rules=None,
+             mqtt_qos=0, mqtt_batch_steps=1, mqtt_encoding='pandas', mqtt_per_entity=False,
+             step_size=900, changes_only=False, change_tolerance=0,
+             wandb_every=1, wandb_interval=0, wandb_project='illuminator-project', wandb_mode=None,
+             mqtt_client=None):
+        # flush_steps: write the buffered results every flush_steps steps
+        # flush_interval: ... or when flush_interval seconds (wall clock) passed
+        # async_writes: write in a background thread, with at most queue_size
+        #   blocks waiting; backpressure is 'block', 'drop-oldest' or 'spill'
+        # history: results kept in memory, 'off', 'all', 'ring' (the last
+        #   history_size steps) or 'downsample' (every history_every-th step);
+        #   by default 'all' with print_results and 'off' otherwise
+        # aggregate_window: write aggregates over windows of this many seconds,
+        #   aggregate_rules: {column pattern: 'mean'/'min'/'max'/'sum'/'last'/'raw'}
+        # mqtt_*: see result_writers.MQTTWriter; mqtt_client replaces the
+        #   paho client, e.g. by a stand-in in tests
+        # step_size: collect every step_size time steps, or only when there
+        #   are inputs if None
+        # changes_only: only write values to the file outputs that changed by
+        #   more than change_tolerance, see result_writers.ChangeFilter
+        # wandb_*: see result_writers.WandbWriter
         self.time_resolution = time_resolution
+        self.step_size = step_size
         self.start_date = pd.to_datetime(start_date, format=date_format)
         self.output_file = output_file
         self.print_results = print_results
         self.results_show=results_show
         self.db_file=db_file
-        self.mqtt_client=None
         self.mqtt_topic=mqtt_topic
         self.mqtt_broker=mqtt_broker
+        self.flush_interval = flush_interval
+        self.last_flush = walltime.monotonic()
+        self.buffer = result_writers.ResultBuffer(flush_steps)
+        # The file outputs are written in blocks of flush_steps steps, the
+        # live outputs (MQTT, dashboard) get every step right away and
+        # batch or throttle on their own
+        files = []
+        live = []
+        if self.results_show['write2csv']==True:
+            files.append(('csv', result_writers.CSVWriter(self.output_file)))
+        if self.results_show.get('write2parquet', False):
+            # Next to the csv file, e.g. Result/results.parquet
+            files.append(('parquet', result_writers.ParquetWriter(
+                os.path.splitext(self.output_file)[0] + '.parquet', compression)))
+        if self.results_show['database']==True:
+            files.append(('database', result_writers.SQLiteWriter(self.db_file)))
+        if self.results_show['dashboard_show']==True:
+            live.append(('dashboard', result_writers.WandbWriter(
+                self.start_date, (step_size or 900) * time_resolution, wandb_every, wandb_interval,
+                wandb_project, wandb_mode)))
+        if self.results_show.get('mqtt', False):
+            live.append(('mqtt', result_writers.MQTTWriter(
+                self.mqtt_broker, self.mqtt_topic, mqtt_qos, mqtt_batch_steps, mqtt_encoding,
+                mqtt_per_entity, mqtt_client)))
+        # Recording rules, see result_writers.RecordingRules
+        self.rules = None
+        if self.results_show.get('record'):
+            self.rules = result_writers.RecordingRules(self.results_show['record'])
+
+        def wrap(writers, changes=False):
+            if self.rules is not None:
+                writers = [result_writers.Route(writer, self.rules, output)
+                           for output, writer in writers]
+            else:
+                writers = [writer for _, writer in writers]
+            if not writers:
+                return writers
+            if changes:
+                writers = [result_writers.ChangeFilter(writers, change_tolerance)]
+            if aggregate_window:
+                writers = [result_writers.Aggregator(writers, aggregate_window, aggregate_rules)]
+            if async_writes:
+                # Outermost, so the aggregation runs in the writer thread too
+                writers = [result_writers.AsyncWriter(writers, queue_size, backpressure, spill_dir)]
+            return writers
+
+        # The live outputs always get the full step
+        self.writers = wrap(files, changes_only)
+        self.live_writers = wrap(live)
+        if history is None:
+            history = 'all' if print_results else 'off'
+        if history != 'off':
+            self.history = result_writers.ResultHistory(history, history_size, history_every)
+            self.writers.append(self.history)
 
         return self.meta
 
@@ -50,80 +129,58 @@ class Collector(mosaik_api.Simulator):
         self.eid = 'Monitor'
         print('Collector create: bye')
 
-        if self.results_show['database']==True:
-            # if os.path.exists(self.db_file):
-            #     os.remove(self.db_file)
-            self.conn = sqlite3.connect(self.db_file)
-            self.cursor = self.conn.cursor()
-            #self.cursor.execute("ALTER TABLE pv_gen ADD COLUMN date DATATYPE;")
-        if self.results_show['mqtt'] == True:
-            self.mqtt_client = mqtt.Client()
-            broker_url = urlparse(self.mqtt_broker)
-            if broker_url.hostname and broker_url.port:
-                self.mqtt_client.connect(broker_url.hostname, broker_url.port)
-            else:
-                print('hostname:', broker_url.hostname)
-                print('port:', broker_url.port)
-                raise ValueError('Invalid host.')
-
         return [{'eid': self.eid, 'type': model}]
 
     def step(self, time, inputs, max_advance):
         # print(inputs)
-        current_date = (self.start_date
-                        + pd.Timedelta(time * self.time_resolution, unit='seconds'))
-
-        df_dict = {'date': current_date}
-
-        data = inputs.get(self.eid, {})
-        for attr, values in data.items():
-            for src, value in values.items():
-                self.data[src][attr][time] = value
-                df_dict[f'{src}-{attr}'] = [value]
-
-        df = pd.DataFrame.from_dict(df_dict)
-        df = df.set_index('date')
-
-        if self.results_show['dashboard_show']==True:
-            for key, value in df.items():
-                wandb.log({key: value[0],
-                           "custom_step":time/900})
-
-        if self.results_show['write2csv']==True:
-            if time == 0:
-                df.to_csv(self.output_file, mode='w', header=True)
-            else:
-                df.to_csv(self.output_file, mode='a', header=False)
-
-
-        if self.results_show['database']==True:
-            today_date = pd.Timestamp.now().normalize()
-
-            # Change the date component to today's date, but keep the time component
-            df.index = df.index.map(
-                lambda dt: pd.Timestamp(year=today_date.year, month=today_date.month, day=today_date.day-1, hour=dt.hour,
-                                        minute=dt.minute, second=dt.second))
-
-            df.reset_index(inplace=True)
-            df.to_sql(attr, self.conn, if_exists='append', index=False)
-            self.conn.commit()
-        if self.results_show.get('mqtt', False):
-            msg = df.to_json()
-            self.mqtt_client.publish(self.mqtt_topic, msg)
-
-        return time + 900
+        batch = result_writers.StepBatch.from_inputs(inputs.get(self.eid, {}))
+        if self.rules is not None:
+            batch = self.rules.filter(time * self.time_resolution, batch)
+        if self.live_writers:
+            dates = self.dates(pd.Index([time]).to_numpy())
+            block = batch.row()
+            for writer in self.live_writers:
+                writer.write(dates, batch.keys, block)
+        full = self.buffer.append(time, batch)
+        if full or walltime.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+        if self.step_size is None:
+            return None
+        return time + self.step_size
+
+    def flush(self):
+        """Hand the buffered steps to the writers."""
+        self.last_flush = walltime.monotonic()
+        if not len(self.buffer):
+            return
+        times, columns, block = self.buffer.take()
+        dates = self.dates(times)
+        for writer in self.writers:
+            writer.write(dates, columns, block)
+
+    def dates(self, times):
+        """Return the dates of the simulation *times* as datetime64[s]."""
+        return (self.start_date.to_datetime64().astype('datetime64[s]')
+                + (times * self.time_resolution).astype('timedelta64[s]'))
 
     def finalize(self):
-        if self.print_results:
+        self.flush()
+        for writer in self.writers + self.live_writers:
+            writer.close()
+
+        if self.print_results and self.history is not None:
             print('Collected data:')
-            for sim, sim_data in sorted(self.data.items()):
-                print('- %s:' % sim)
-                for attr, values in sorted(sim_data.items()):
+            dates, columns, block = self.history.get()
+            dates = [str(date).replace('T', ' ') for date in dates]
+            for src in sorted(set(src for src, _ in columns)):
+                print('- %s:' % src)
+                for attr, col in sorted((attr, col) for col, (s, attr) in enumerate(columns)
+                                        if s == src):
+                    values = {date: value for date, value in zip(dates, block[:, col].tolist())
+                              if value == value}
                     print('  - %s: %s' % (attr, values))
 
-        if self.results_show['database']==True:
-            self.conn.close()
-
 
 if __name__ == '__main__':
     mosaik_api.start_simulation(Collector())
\ No newline at end of file
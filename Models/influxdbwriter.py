@@ -2,10 +2,14 @@ from __future__ import annotations
 
 from mosaik_api.datetime import Converter
 import mosaik_api
-import numpy as np
 import influxdb_client as influx
 import os
 
+try:
+    import Models.result_writers as result_writers
+except ModuleNotFoundError:
+    import result_writers
+
 
 META = {
     "type": "time-based",
@@ -42,6 +46,11 @@ class Simulator(mosaik_api.Simulator):
 
     This simulator will run as a `time-based` simulator when given a
     `step_size`, otherwise it will be `event-based`.
+
+    All values of a step are written with a single `write()` call, as one
+    point per source entity holding all its attributes as fields. The write
+    API batches the points in the background; `batch_size` (points) and
+    `flush_interval` (milliseconds) configure when a batch is sent.
     """
 
     _eid: str
@@ -52,14 +61,29 @@ class Simulator(mosaik_api.Simulator):
     """If _step_size is None, the simulator is running in event-based mode."""
     _time_converter: Converter | None
     """If _time_converter is None, a time needs to be explicitly set in step's input."""
+    _write_options: influx.WriteOptions
+    _tags: dict[str, dict[str, str]]
+    """The `src_sim` and `src_entity` tags of every source ID seen so far."""
 
     def __init__(self):
         super().__init__(META)
         self._influx_writer = None  # type: ignore  # will be set in `create`
         self._time_converter = None
         self._step_size = None
-
-    def init(self, sid, time_resolution, start_date=None, step_size=900):
+        self._tags = {}
+
+    def init(
+        self,
+        sid,
+        time_resolution,
+        start_date=None,
+        step_size=900,
+        batch_size=1000,
+        flush_interval=1000,
+    ):
+        self._write_options = influx.WriteOptions(
+            batch_size=batch_size, flush_interval=flush_interval
+        )
         if step_size is not None:
             self._step_size = step_size
         else:
@@ -89,7 +113,7 @@ class Simulator(mosaik_api.Simulator):
 
         self._influx_writer = influx.InfluxDBClient(
             url=url, token=token, org=org
-        ).write_api()  # default write mode is "batching"
+        ).write_api(write_options=self._write_options)
 
         return [{"eid": EID, "type": model}]
 
@@ -109,24 +133,30 @@ class Simulator(mosaik_api.Simulator):
                 "simulator."
             )
 
-        for attr, src_ids in data.items():
-            for src_id, val in src_ids.items():
-                if isinstance(val, np.generic):
-                    # Influx cannot handle numpy datatypes, so transform them into
-                    # standard Python types.
-                    val = val.item()
+        # Influx cannot handle numpy datatypes, the batch holds standard
+        # Python types.
+        fields = result_writers.StepBatch.from_inputs(data).by_source()
+
+        records = []
+        for src_id, src_fields in fields.items():
+            tags = self._tags.get(src_id)
+            if tags is None:
                 src_sim, src_entity = src_id.split(".")
-                record = (
-                    influx.Point(self._measurement)
-                    .tag("src_sim", src_sim)
-                    .tag("src_entity", src_entity)
-                    .field(attr, val)
-                    .time(timestamp)
-                )
-                self._influx_writer.write(
-                    bucket=self._bucket,
-                    record=record,
+                tags = self._tags[src_id] = {
+                    "src_sim": src_sim,
+                    "src_entity": src_entity,
+                }
+            records.append(
+                influx.Point.from_dict(
+                    {
+                        "measurement": self._measurement,
+                        "tags": tags,
+                        "fields": src_fields,
+                        "time": timestamp,
+                    }
                 )
+            )
+        self._influx_writer.write(bucket=self._bucket, record=records)
 
         # Only return a next step if running in time-based mode
         if self._step_size:
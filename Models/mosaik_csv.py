@@ -1,73 +1,226 @@
+import os
+
 import arrow
 
 import mosaik_api
 
+try:
+    import Models.scenario_cache as scenario_cache
+except ModuleNotFoundError:
+    import scenario_cache
+
+
+__version__ = '1.3.0'
+
+
+class CachedReader:
+    """Serve the rows of one datafile from the binary scenario cache.
 
-__version__ = '1.2.0'
+    The rows are read through a :class:`scenario_cache.ScenarioView`, so
+    the series can be shifted by *offset* seconds, resampled to
+    *step_size* seconds (see the view for the *resample* methods) and
+    looped with *repeat*. *model* renames the model of the datafile.
+    """
+
+    def __init__(self, datafile, date_format, delimiter, cache_dir=None, model=None,
+                 offset=0, step_size=None, resample='mean', repeat=False):
+        self.date_format = date_format
+        self.data = scenario_cache.ScenarioView(
+            scenario_cache.load(datafile, date_format, delimiter, cache_dir),
+            offset, step_size, resample, repeat)
+        self.modelname = model or self.data.modelname
+        self.attrs = self.data.attrs
+        self.row = None
+        self.next_date = None
+        self.cache = None
+
+    def seek(self, start):
+        self.row = self.data.find(start)
+        if self.row is None:
+            raise ValueError('Start date "%s" not in CSV file.' %
+                             arrow.get(start).format(self.date_format))
+        self.next_date = self.data.date(self.row)
+
+    def read(self):
+        # Put data into the cache for get_data() calls
+        self.cache = dict(zip(self.attrs, self.data.row(self.row).tolist()))
+        self.row += 1
+        self.next_date = self.data.date(self.row)
+
+    def horizon(self, n, attrs=None):
+        """Return the dates and values of the next *n* rows, starting with
+        the row of the current step (see
+        :meth:`scenario_cache.ScenarioView.horizon`)."""
+        row = self.row - 1 if self.cache is not None else self.row
+        return self.data.horizon(row, n, attrs)
+
+    def close(self):
+        pass
+
+
+class TextReader:
+    """Read the rows of one datafile line by line from the text file.
+
+    If *index* is true, the start date is found through the row offset
+    index of :mod:`scenario_cache` instead of parsing all preceding rows.
+    Compressed datafiles are decompressed while reading; with the index,
+    reading starts at the compressed block that holds the start date.
+    """
+
+    def __init__(self, datafile, date_format, delimiter, cache_dir=None, index=True):
+        self.datafile_name = datafile
+        self.date_format = date_format
+        self.delimiter = delimiter
+        self.cache_dir = cache_dir
+        self.index = index
+        self.datafile = scenario_cache.open_binary(datafile)
+        self.modelname, self.attrs = scenario_cache.parse_header(
+            (line.decode() for line in self.datafile), self.delimiter)
+        self.next_row = None
+        self.next_date = None
+        self.cache = None
+
+    def seek(self, start):
+        if self.index:
+            # Jump to the first row at or after the start date
+            offsets = scenario_cache.load_index(self.datafile_name, self.date_format,
+                                                self.delimiter, self.cache_dir)
+            row = offsets[:, 0].searchsorted(start)
+            if row < len(offsets):
+                self._open_at(int(offsets[row, 1]), int(offsets[row, 2]))
+            else:
+                self._open_at(os.path.getsize(self.datafile_name), 0)
+
+        # Check start date
+        self._read_next_row()
+        if self.next_row is None or start < self.next_date:
+            raise ValueError('Start date "%s" not in CSV file.' %
+                             arrow.get(start).format(self.date_format))
+        while start > self.next_date:
+            self._read_next_row()
+            if self.next_row is None:
+                raise ValueError('Start date "%s" not in CSV file.' %
+                                 arrow.get(start).format(self.date_format))
+
+    def read(self):
+        # Put data into the cache for get_data() calls
+        self.cache = {}
+        for attr, val in zip(self.attrs, self.next_row[1:]):
+            self.cache[attr] = float(val)
+        self._read_next_row()
+
+    def close(self):
+        self.datafile.close()
+
+    def _open_at(self, block, offset):
+        # Continue reading at *offset* bytes into the block at *block*
+        self.datafile.close()
+        self.datafile = scenario_cache.open_binary(self.datafile_name, block)
+        while offset > 0:
+            skipped = len(self.datafile.read(min(offset, 1 << 20)))
+            if not skipped:
+                break
+            offset -= skipped
+
+    def _read_next_row(self):
+        try:
+            self.next_row = next(self.datafile).decode().strip().split(self.delimiter)
+            self.next_date = arrow.get(self.next_row[0], self.date_format).int_timestamp
+        except StopIteration:
+            self.next_row = None
+            self.next_date = None
 
 
 class CSV(mosaik_api.Simulator):
+    """Serve one or more scenario datafiles as mosaik models.
+
+    *datafile* is either a single path or a list of paths. Every datafile
+    provides the model named in its first line, so one simulator process can
+    host all the scenario inputs of a case.
+
+    *offset*, *step_size*, *resample* and *repeat* give a virtual view on the
+    datafiles (see :class:`CachedReader`). Instead of a path, a list entry
+    can be a dict with the key ``'datafile'`` and any of ``'model'``,
+    ``'offset'``, ``'step_size'``, ``'resample'`` and ``'repeat'`` to set the
+    view for that file only, e.g.
+    ``{'datafile': 'Scenarios/winddata_NL.txt', 'model': 'WS_shifted',
+    'offset': 3600}``.
+
+    With *horizon* > 0, every attribute ``attr`` also gets an attribute
+    ``attr_horizon`` with the list of its values over the next *horizon*
+    rows, starting with the current one.
+    """
+
     def __init__(self):
         super().__init__({'models': {}})
         self.time_resolution = None
         self.start_date = None
         self.date_format = None
         self.delimiter = None
-        self.datafile = None
-        self.next_row = None
-        self.modelname = None
-        self.attrs = None
-        self.eids = []
-        self.cache = None
+        self.readers = {}
+        self.eids = {}
+        self.horizon = 0
 
     def init(self, sid, time_resolution, sim_start, datafile, date_format='YYYY-MM-DD HH:mm:ss',
-             delimiter=','):
+             delimiter=',', cache=True, cache_dir=None, index=True, offset=0, step_size=None,
+             resample='mean', repeat=False, horizon=0):
         self.time_resolution = float(time_resolution)
         self.delimiter = delimiter
         self.date_format = date_format
         self.start_date = arrow.get(sim_start, self.date_format)
-        self.next_date = self.start_date
-
-        self.datafile = open(datafile)
-        self.modelname = next(self.datafile).strip()
-
-        # Get attribute names and strip optional comments
-        attrs = next(self.datafile).strip().split(self.delimiter)[1:]
-        for i, attr in enumerate(attrs):
-            try:
-                # Try stripping comments
-                attr = attr[:attr.index('#')]
-            except ValueError:
-                pass
-            attrs[i] = attr.strip()
-        self.attrs = attrs
+        start = self.start_date.int_timestamp
+        self.horizon = horizon
+        if horizon and not cache:
+            raise ValueError('The horizon attributes require cache=True.')
 
-        self.meta['type'] = 'time-based'
+        defaults = {'model': None, 'offset': offset, 'step_size': step_size,
+                    'resample': resample, 'repeat': repeat}
+        datafiles = [datafile] if isinstance(datafile, (str, dict)) else list(datafile)
+        views = {}
+        for spec in datafiles:
+            if isinstance(spec, str):
+                spec = {'datafile': spec}
+            view = dict(defaults, **spec)
+            views[tuple(sorted(view.items()))] = view
 
-        self.meta['models'][self.modelname] = {
-            'public': True,
-            'params': [],
-            'attrs': attrs,
-        }
+        for view in views.values():
+            datafile = view.pop('datafile')
+            if cache:
+                reader = CachedReader(datafile, date_format, delimiter, cache_dir, **view)
+            elif view['offset'] or view['step_size'] or view['repeat']:
+                raise ValueError('Views on "%s" require cache=True.' % datafile)
+            else:
+                reader = TextReader(datafile, date_format, delimiter, cache_dir, index)
+                reader.modelname = view['model'] or reader.modelname
+            if reader.modelname in self.readers:
+                reader.close()
+                raise ValueError('Model "%s" of "%s" is already provided by another '
+                                 'datafile.' % (reader.modelname, datafile))
+            self.readers[reader.modelname] = reader
 
-        # Check start date
-        self._read_next_row()
-        if self.start_date < self.next_row[0]:
-            raise ValueError('Start date "%s" not in CSV file.' %
-                             self.start_date.format(self.date_format))
-        while self.start_date > self.next_row[0]:
-            self._read_next_row()
-            if self.next_row is None:
-                raise ValueError('Start date "%s" not in CSV file.' %
-                                 self.start_date.format(self.date_format))
+            attrs = list(reader.attrs)
+            if horizon:
+                attrs += ['%s_horizon' % attr for attr in reader.attrs]
+            self.meta['models'][reader.modelname] = {
+                'public': True,
+                'params': [],
+                'attrs': attrs,
+            }
+
+            reader.seek(start)
+            if reader.next_date != start:
+                raise ValueError('Start date "%s" not in CSV file "%s".' %
+                                 (self.start_date.format(self.date_format), datafile))
+
+        self.meta['type'] = 'time-based'
 
         return self.meta
 
     def create(self, num, model):
-        if model != self.modelname:
-            raise ValueError('Invalid model "%s" % model')
+        if model not in self.readers:
+            raise ValueError('Invalid model "%s"' % model)
 
-        start_idx = len(self.eids)
+        start_idx = sum(1 for reader in self.eids.values() if reader.modelname == model)
         entities = []
         for i in range(num):
             eid = '%s_%s' % (model, i + start_idx)
@@ -76,30 +229,36 @@ class CSV(mosaik_api.Simulator):
                 'type': model,
                 'rel': [],
             })
-            self.eids.append(eid)
+            self.eids[eid] = self.readers[model]
         return entities
 
     def step(self, time, inputs, max_advance):
-        data = self.next_row
-        if data is None:
-            raise IndexError('End of CSV file reached.')
-
-        # Check date
-        date = data[0]
-        expected_date = self.start_date.shift(seconds=time*self.time_resolution)
-        if date != expected_date:
-            raise IndexError('Wrong date "%s", expected "%s"' % (
-                date.format(self.date_format),
-                expected_date.format(self.date_format)))
+        date = self.start_date.int_timestamp + int(time * self.time_resolution)
 
-        # Put data into the cache for get_data() calls
-        self.cache = {}
-        for attr, val in zip(self.attrs, data[1:]):
-            self.cache[attr] = float(val)
+        # Advance every datafile that has a row at this date. Datafiles
+        # with a gap keep their last values until their next row.
+        stepped = False
+        next_dates = []
+        for reader in self.readers.values():
+            if reader.next_date is not None and reader.next_date < date:
+                raise IndexError('Wrong date "%s", expected "%s"' % (
+                    arrow.get(reader.next_date).format(self.date_format),
+                    arrow.get(date).format(self.date_format)))
+            if reader.next_date == date:
+                reader.read()
+                stepped = True
+            if reader.next_date is not None:
+                next_dates.append(reader.next_date)
 
-        self._read_next_row()
-        if self.next_row is not None:
-            return time + int((self.next_row[0].int_timestamp - date.int_timestamp)/self.time_resolution)
+        if not stepped:
+            if not next_dates:
+                raise IndexError('End of CSV file reached.')
+            raise IndexError('Wrong date "%s", expected "%s"' % (
+                arrow.get(min(next_dates)).format(self.date_format),
+                arrow.get(date).format(self.date_format)))
+
+        if next_dates:
+            return time + int((min(next_dates) - date) / self.time_resolution)
         else:
             return max_advance
 
@@ -109,21 +268,22 @@ class CSV(mosaik_api.Simulator):
             if eid not in self.eids:
                 raise ValueError('Unknown entity ID "%s"' % eid)
 
+            reader = self.eids[eid]
             data[eid] = {}
             for attr in attrs:
-                data[eid][attr] = self.cache[attr]
+                if attr in reader.cache:
+                    data[eid][attr] = reader.cache[attr]
+                else:
+                    # An "<attr>_horizon" look-ahead attribute
+                    attr_name = attr[:-len('_horizon')]
+                    _, values = reader.horizon(self.horizon, [attr_name])
+                    data[eid][attr] = values[attr_name].tolist()
 
         return data
 
-    def _read_next_row(self):
-        try:
-            self.next_row = next(self.datafile).strip().split(self.delimiter)
-            self.next_row[0] = arrow.get(self.next_row[0], self.date_format)
-        except StopIteration:
-            self.next_row = None
-
     def finalize(self):
-        self.datafile.close()
+        for reader in self.readers.values():
+            reader.close()
 
 
 def main():
@@ -1,12 +1,25 @@
 """
 Store mosaik simulation data in an sql.
 
+The data is written to a MySQL server, or to a SQLite database file as a
+stand-in target that needs no server (``backend='sqlite'``).
+
 """
+import csv
 import datetime
-import mysql.connector
+import os
+import sqlite3
+import tempfile
+import time as walltime
+
 import mosaik_api
 
-__version__ = '0.1'
+try:
+    import Models.result_writers as result_writers
+except ModuleNotFoundError:
+    import result_writers
+
+__version__ = '0.2'
 meta = {
     'models': {
         'mosaik_sql': {
@@ -38,6 +51,9 @@ class SQL(mosaik_api.Simulator):
         self.create_tables = None  # What type of new database schema should be created?
         self.table_name = None
         self.buf_size = None
+        self.flush_interval = None
+        self.backend = None
+        self.bulk_load = None
 
         # Set in create()
         self._cur = None
@@ -47,9 +63,12 @@ class SQL(mosaik_api.Simulator):
         # Used in step()
         self._query_buf = {}
         self._insert_queries = {}
+        self._columns = {}
+        self._buf_rows = 0
+        self._last_flush = None
 
     def init(self, sid, step_size, sim_start, hostname, username, password, database, create_tables=None,
-             table_name=None, buf_size=0):
+             table_name=None, buf_size=0, flush_interval=None, backend='mysql', bulk_load=False):
         '''
 
         :param sid:
@@ -58,13 +77,18 @@ class SQL(mosaik_api.Simulator):
         :param hostname:
         :param username:
         :param password:
-        :param database:
+        :param database: The database name, or the database file for the 'sqlite' backend.
         :param create_tables: Defines which database schema will be created to store the results. 'single' means
         one table for all values. 'multi' means multiple tables are created. For each entity one.
         :param table_name: If create_tables is 'single' this defines the name of this table.
-        :param buf_size: Size of the buffer storing data until it is written to database
+        :param buf_size: Number of rows buffered until they are written to the database. 0 writes every step.
+        :param flush_interval: Also write the buffer when it is older than this many seconds (wall clock).
+        :param backend: 'mysql' or 'sqlite'.
+        :param bulk_load: Write the buffer with LOAD DATA LOCAL INFILE instead of INSERT (mysql only).
         :return:
         '''
+        if backend not in ('mysql', 'sqlite'):
+            raise ValueError('Unknown backend "%s".' % backend)
         self.sid = sid
         self.step_size = step_size
         self.datetime_object = datetime.datetime.strptime(sim_start, '%Y-%m-%d %H:%M:%S')  # needed to upload timestamp
@@ -75,6 +99,9 @@ class SQL(mosaik_api.Simulator):
         self.create_tables = create_tables
         self.table_name = table_name
         self.buf_size = buf_size
+        self.flush_interval = flush_interval
+        self.backend = backend
+        self.bulk_load = bulk_load and backend == 'mysql'
 
         return self.meta
 
@@ -87,11 +114,19 @@ class SQL(mosaik_api.Simulator):
                 'rel': [],
                 'children': []
             })
-        self._my_connection = mysql.connector.connect(host=self.hostname,
-                                                      user=self.username,
-                                                      passwd=self.password,
-                                                      db=self.database)
+        if self.backend == 'sqlite':
+            self._my_connection = sqlite3.connect(self.database)
+            self._my_connection.execute('PRAGMA journal_mode=WAL')
+        else:
+            import mysql.connector
+
+            self._my_connection = mysql.connector.connect(host=self.hostname,
+                                                          user=self.username,
+                                                          passwd=self.password,
+                                                          db=self.database,
+                                                          allow_local_infile=self.bulk_load)
         self._cur = self._my_connection.cursor()
+        self._last_flush = walltime.monotonic()
         print('initialized sql_db')
 
         return model_list
@@ -99,16 +134,11 @@ class SQL(mosaik_api.Simulator):
     def setup_done(self):
         print('setup done')
 
-    def step(self, time, inputs):
+    def step(self, time, inputs, max_advance=None):
         timestamp = self.datetime_object + datetime.timedelta(seconds=time)
 
-        attr_dict = {}
-        for sink_id, data in inputs.items():
-            for attr, data2 in data.items():
-                for src_id, value in data2.items():
-                    if src_id not in attr_dict:
-                        attr_dict[src_id] = []
-                    attr_dict[src_id].append((attr, value))
+        # {src_id: {attr: value}} of Python values
+        attr_dict = result_writers.StepBatch.from_inputs(*inputs.values()).by_source()
         if time == 0 and self.create_tables:
             self.create_database(attr_dict)
 
@@ -118,6 +148,8 @@ class SQL(mosaik_api.Simulator):
         return time + self.step_size
 
     def create_database(self, attr_dict):
+        # '?' is the placeholder of sqlite3, '%s' the one of mysql.connector
+        placeholder = '?' if self.backend == 'sqlite' else '%s'
         if self.create_tables == 'multi':
             for src_id in attr_dict:
                 query_drop_if_exists = "DROP TABLE IF EXISTS `" + src_id + "`;"
@@ -128,22 +160,23 @@ class SQL(mosaik_api.Simulator):
                 query_attr = ""
                 query_end = ");"
                 attr_list = ['ts']
-                for attr, value in attr_dict[src_id]:
+                for attr, value in attr_dict[src_id].items():
                     attr_list.append(attr)
                     if isinstance(value, int):
                         query_attr = query_attr + "`" + attr + "` INT,"
-                    if isinstance(value, float):
+                    elif isinstance(value, float):
                         query_attr = query_attr + "`" + attr + "` DOUBLE,"
                     else:
-                        query_attr = query_attr + "`" + attr + "` VARCHAR(64)"
+                        query_attr = query_attr + "`" + attr + "` VARCHAR(64),"
                 query_attr = query_attr[0: (len(query_attr) - 1)]
                 query = query_start + query_attr + query_end
                 # print(query)
                 self._cur.execute(query)
 
                 self._query_buf[src_id] = []
-                attr_list_string = str(attr_list)[1:-1].replace('\'', '')
-                placeholder_string = str(['%s' for x in attr_list])[1:-1].replace('\'', '')
+                self._columns[src_id] = attr_list[1:]
+                attr_list_string = ', '.join('`%s`' % attr for attr in attr_list)
+                placeholder_string = ', '.join(placeholder for x in attr_list)
                 self._insert_queries[src_id] = "INSERT INTO `" + src_id + "` (" + attr_list_string + ") VALUES (" + \
                                                 placeholder_string + ")"
         elif self.create_tables == 'single':
@@ -159,46 +192,76 @@ class SQL(mosaik_api.Simulator):
             print(query)
             self._cur.execute(query)
             self._query_buf[self.table_name] = []
+            self._columns[self.table_name] = ['id', 'ts', 'src', 'valueName', 'value']
             self._insert_queries[self.table_name] = "INSERT INTO `" + self.table_name + \
                                                     "` (id, ts, src, valueName, value ) VALUES (" + \
-                                                    "%s,%s,%s,%s,%s)"
-
+                                                    ', '.join([placeholder] * 5) + ")"
+        self._my_connection.commit()
 
     def insert_values(self, attr_dict, timestamp):
         if self.create_tables == 'multi':
             for src_id in attr_dict:
-                attr_list = [str(timestamp)]
-                for attr, value in attr_dict[src_id]:
-                    if value.__class__.__name__.lower() == 'float64':
-                        value = float(value)
-                    attr_list.append(value)
-                self._query_buf[src_id].append(tuple(attr_list))
-                # self._cur.executemany(self._insert_queries[src_id], data)
-
-            if self.buf_size == 0 or 0 < self.buf_size < len(self._query_buf):
-                self.execute_insert()
+                if src_id not in self._query_buf:
+                    print('No table for "%s", its values are not stored' % src_id)
+                    continue
+                values = attr_dict[src_id]
+                self._query_buf[src_id].append(
+                    (str(timestamp),) + tuple(values.get(attr) for attr in self._columns[src_id]))
+                self._buf_rows += 1
         elif self.create_tables == 'single':
             for src_id in attr_dict:
-                for attr, value in attr_dict[src_id]:
+                for attr, value in attr_dict[src_id].items():
                     self._query_buf[self.table_name].append((self.index, str(timestamp), str(src_id), str(attr), str(value)))
                     self.index += 1
-            if self.buf_size == 0 or 0 < self.buf_size < len(self._query_buf):
-                self._cur.executemany(self._insert_queries[self.table_name], self._query_buf[self.table_name])
-                self._my_connection.commit()
-                self._query_buf[self.table_name] = []
+                    self._buf_rows += 1
+
+        if (self.buf_size == 0 or self._buf_rows >= self.buf_size
+                or (self.flush_interval is not None
+                    and walltime.monotonic() - self._last_flush >= self.flush_interval)):
+            self.execute_insert()
 
     def execute_insert(self):
-        print('execute query')
-        for src_id in self._query_buf.keys():
-            self._cur.executemany(self._insert_queries[src_id], self._query_buf[src_id])
+        """Write the buffered rows of all tables in one transaction."""
+        self._last_flush = walltime.monotonic()
+        if not self._buf_rows:
+            return
+        try:
+            for table, rows in self._query_buf.items():
+                if not rows:
+                    continue
+                if self.bulk_load:
+                    self._load_data(table, rows)
+                else:
+                    self._cur.executemany(self._insert_queries[table], rows)
             self._my_connection.commit()
-            self._query_buf[src_id] = []
+        except Exception:
+            self._my_connection.rollback()
+            raise
+        for table in self._query_buf:
+            self._query_buf[table] = []
+        self._buf_rows = 0
+
+    def _load_data(self, table, rows):
+        # Bulk path of MySQL: load the rows from a temporary csv file
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w', newline='') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                # MySQL loads True and False into int columns as 0, so bools
+                # are written as 1 and 0 like the executemany path stores them
+                writer.writerows(('\\N' if value is None else int(value) if isinstance(value, bool)
+                                  else value for value in row) for row in rows)
+            self._cur.execute("LOAD DATA LOCAL INFILE '" + path.replace('\\', '/') + "' INTO TABLE `" + table +
+                              "` FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' (" +
+                              ', '.join('`%s`' % c for c in (['ts'] if self.create_tables == 'multi' else []) +
+                                        self._columns[table]) + ")")
+        finally:
+            os.remove(path)
 
     def finalize(self):
-        if self.buf_size > 0:
-            if len(self._query_buf) > 0:
-                print('finalize with not empty buffer')
-                self.execute_insert()
+        if self._buf_rows > 0:
+            print('finalize with not empty buffer')
+            self.execute_insert()
 
         self._my_connection.close()
 
@@ -0,0 +1,1278 @@
+"""
+Buffered result output for the ``Collector``.
+
+The inputs of a step are flattened once into a :class:`StepBatch`, the
+columnar form of the nested mosaik inputs that all outputs consume (the
+collector as well as the ``mosaik_sql`` and ``influxdbwriter`` simulators).
+
+The collector does not write every step on its own. It appends the step to a
+:class:`ResultBuffer`, a preallocated NumPy block with one column per
+``(source, attribute)`` pair, and hands the buffered rows to its writers
+every few steps. A writer gets the block as ``(dates, columns, block)``:
+
+* ``dates``: ``datetime64[s]`` array with the date of every row,
+* ``columns``: list of ``(source, attribute)`` keys, one per block column,
+* ``block``: ``(rows, len(columns))`` array, ``NaN`` where a source sent
+  no value at that step.
+
+:class:`RecordingRules` select the entities and attributes that are
+recorded at all, how often and by which writers.
+
+With a :class:`ChangeFilter`, only the values that changed are written;
+``read_results(..., dense=True)`` fills the series in again.
+
+An :class:`Aggregator` in front of the writers reduces the results to
+windows (hourly means, daily maxima, ...) before they are written.
+
+With :class:`AsyncWriter`, the writers run in a background thread, so a
+slow disk, database or broker does not hold up the simulation.
+
+Results written with :class:`ParquetWriter`, :class:`SQLiteWriter` or
+:class:`CSVWriter` are read
+back with :func:`read_results`, which loads only the requested columns and
+dates.
+
+"""
+import collections
+import fnmatch
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time as walltime
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+
+def column_name(key):
+    """Return the column name of a ``(source, attribute)`` key, like
+    ``'PV-0.pv_0-pv_gen'``."""
+    return '%s-%s' % key
+
+
+def column_key(name):
+    """Return the ``(source, attribute)`` key of a column name (the
+    inverse of :func:`column_name`)."""
+    src, attr = name.rsplit('-', 1)
+    return src, attr
+
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+"""Format of the dates in the CSV output; pandas would drop the time of a
+block that only has midnight rows."""
+
+_FLOATS = frozenset((float, np.float64))
+
+
+class StepBatch:
+    """The inputs of one step as columns, flattened once for all outputs.
+
+    * ``keys``: list of ``(source, attribute)`` keys, one per value,
+    * ``values``: float64 array of the values, ``NaN`` where a value is
+      missing or not a number,
+    * ``objects``: ``{index: value}`` of the values that are not floats
+      (ints, bools, text, ``None``, ...) as plain Python objects,
+    * ``numeric``: true if all values are numbers or missing.
+
+    Outputs that store numbers use ``values`` as is; outputs that keep the
+    types of the values use :meth:`to_python` or :meth:`by_source`, which
+    return Python objects instead of NumPy scalars.
+    """
+
+    __slots__ = ('keys', 'values', 'objects', 'numeric')
+
+    def __init__(self, keys, values, objects=None, numeric=True):
+        self.keys = keys
+        self.values = values
+        self.objects = {} if objects is None else objects
+        self.numeric = numeric
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_inputs(cls, *data):
+        """Flatten the inputs *data* (``{attr: {src: value}}``) of one or
+        more entities."""
+        keys = []
+        items = []
+        for inputs in data:
+            for attr, sources in inputs.items():
+                keys.extend((src, attr) for src in sources)
+                items.extend(sources.values())
+        try:
+            values = np.array(items, dtype=np.float64)
+        except (TypeError, ValueError):
+            values = None
+        if values is not None and (values.ndim != 1 or len(values) != len(items)):
+            # Lists of one length make a matrix
+            values = None
+        if values is not None and _FLOATS.issuperset(map(type, items)):
+            return cls(keys, values)
+
+        fill = values is None
+        if fill:
+            values = np.full(len(items), np.nan)
+        objects = {}
+        numeric = True
+        for i, value in enumerate(items):
+            if type(value) in _FLOATS:
+                if fill:
+                    values[i] = value
+                continue
+            if isinstance(value, np.generic):
+                value = value.item()
+            if value is not None and not isinstance(value, (int, float)):
+                # Text is not a number, even if NumPy could parse it
+                numeric = False
+                values[i] = np.nan
+            elif fill and value is not None:
+                values[i] = value
+            objects[i] = value
+        return cls(keys, values, objects, numeric)
+
+    def select(self, cols):
+        """Return the batch of the columns *cols* (index array)."""
+        cols = np.asarray(cols, dtype=np.intp)
+        objects = {}
+        if self.objects:
+            for new, old in enumerate(cols.tolist()):
+                if old in self.objects:
+                    objects[new] = self.objects[old]
+        numeric = self.numeric or all(value is None or isinstance(value, (int, float))
+                                      for value in objects.values())
+        return StepBatch([self.keys[col] for col in cols.tolist()], self.values[cols], objects,
+                         numeric)
+
+    def to_python(self):
+        """Return the values as a list of Python objects."""
+        values = self.values.tolist()
+        for i, value in self.objects.items():
+            values[i] = value
+        return values
+
+    def row(self):
+        """Return the values as a one-row block, like the blocks the writers
+        get: float64, or object if a value is not a float."""
+        if not self.objects:
+            return self.values[np.newaxis]
+        block = np.empty((1, len(self.keys)), dtype=object)
+        for col, value in enumerate(self.to_python()):
+            block[0, col] = np.nan if value is None else value
+        return block
+
+    def by_source(self):
+        """Return the values as ``{src: {attr: value}}`` of Python objects."""
+        grouped = {}
+        for (src, attr), value in zip(self.keys, self.to_python()):
+            grouped.setdefault(src, {})[attr] = value
+        return grouped
+
+
+class ResultBuffer:
+    """Preallocated block for *size* steps of collector inputs.
+
+    The column index is built from the inputs of the first step; sources or
+    attributes that show up later get a new column. The block is float64
+    and only falls back to an object block if an input is not a number.
+    Columns of ints or bools are stored as floats as well and handed out as
+    Python ints or bools again, in an object block.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.columns = {}
+        self.times = np.empty(size, dtype=np.int64)
+        self.block = np.full((size, 0), np.nan)
+        self.rows = 0
+        # Block columns of the keys of the last batch; the keys rarely change
+        self._keys = None
+        self._cols = None
+        # {column: int or bool} of the columns whose first value was an int
+        # or a bool
+        self.kinds = {}
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, time, batch):
+        """Add the :class:`StepBatch` *batch* of the step at *time*.
+        Returns true when the buffer is full."""
+        row = self.rows
+        self.times[row] = time
+        if batch.keys != self._keys:
+            self._keys = batch.keys
+            self._cols = np.array([self.columns[key] if key in self.columns
+                                   else self._add_column(key) for key in batch.keys],
+                                  dtype=np.intp)
+        for i, value in batch.objects.items():
+            if type(value) in (int, bool):
+                self.kinds.setdefault(int(self._cols[i]), type(value))
+        if batch.numeric and self.block.dtype != object:
+            self.block[row, self._cols] = batch.values
+        else:
+            if self.block.dtype != object:
+                self.block = self.block.astype(object)
+            values = self.block[row]
+            for col, value in zip(self._cols.tolist(), batch.to_python()):
+                values[col] = np.nan if value is None else value
+        self.rows += 1
+        return self.rows == self.size
+
+    def take(self):
+        """Return ``(times, columns, block)`` of the buffered steps and
+        empty the buffer."""
+        rows = self.rows
+        times = self.times[:rows].copy()
+        block = self.block[:rows, :len(self.columns)].copy()
+        self.block[:rows] = np.nan
+        self.rows = 0
+        return times, list(self.columns), self._typed(block)
+
+    def _typed(self, block):
+        # An object block already holds the values as they came in
+        if not self.kinds or block.dtype == object:
+            return block
+        typed = block.astype(object)
+        for col, kind in self.kinds.items():
+            rows = np.flatnonzero(~np.isnan(block[:, col]))
+            values = block[rows, col]
+            if kind is bool and np.isin(values, (0, 1)).all():
+                typed[rows, col] = values.astype(bool).tolist()
+            elif (values == np.round(values)).all():
+                typed[rows, col] = values.astype(np.int64).tolist()
+        return typed
+
+    def _add_column(self, key):
+        col = len(self.columns)
+        self.columns[key] = col
+        if col == self.block.shape[1]:
+            # Grow in steps, so late columns do not copy the block each time
+            block = np.full((self.size, max(8, 2 * col)), np.nan, dtype=self.block.dtype)
+            block[:, :col] = self.block
+            self.block = block
+        return col
+
+
+class ResultHistory:
+    """In-memory history of the results, fed like a writer.
+
+    *mode* is one of
+
+    * ``'all'``: keep every step,
+    * ``'ring'``: keep the last *size* steps,
+    * ``'downsample'``: keep every *every*-th step (and at most the last
+      *size* steps if *size* is given).
+
+    The history is stored in one array block like :class:`ResultBuffer`.
+    """
+
+    def __init__(self, mode='all', size=None, every=1):
+        if mode not in ('all', 'ring', 'downsample'):
+            raise ValueError('Unknown history mode "%s".' % mode)
+        if mode == 'ring' and not size:
+            raise ValueError('The ring history needs a size.')
+        self.size = size if mode != 'all' else None
+        self.every = every if mode == 'downsample' else 1
+        self.columns = {}
+        self.dates = np.empty(size or 1024, dtype='datetime64[s]')
+        self.block = np.full((len(self.dates), 0), np.nan)
+        self.steps = 0
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, len(self.dates))
+
+    def write(self, dates, columns, block):
+        keep = (self.steps + np.arange(len(dates))) % self.every == 0
+        self.steps += len(dates)
+        dates = dates[keep]
+        block = block[keep]
+        if self.size is not None and len(dates) > self.size:
+            # Only the last rows fit in the ring
+            self.count += len(dates) - self.size
+            dates = dates[-self.size:]
+            block = block[-self.size:]
+        elif self.size is None and self.count + len(dates) > len(self.dates):
+            self._resize(max(2 * len(self.dates), self.count + len(dates)), self.block.shape[1])
+
+        cols = [self._column(key) for key in columns]
+        if block.dtype == object and self.block.dtype != object:
+            self.block = self.block.astype(object)
+        rows = (self.count + np.arange(len(dates))) % len(self.dates)
+        self.dates[rows] = dates
+        self.block[rows] = np.nan
+        self.block[np.ix_(rows, cols)] = block
+        self.count += len(dates)
+
+    def get(self):
+        """Return ``(dates, columns, block)`` of the kept steps, oldest
+        first."""
+        n = len(self)
+        rows = (self.count - n + np.arange(n)) % len(self.dates)
+        return self.dates[rows], list(self.columns), self.block[rows, :len(self.columns)]
+
+    def close(self):
+        pass
+
+    def _column(self, key):
+        col = self.columns.get(key)
+        if col is None:
+            col = self.columns[key] = len(self.columns)
+            if col == self.block.shape[1]:
+                self._resize(len(self.dates), max(8, 2 * col))
+        return col
+
+    def _resize(self, rows, cols):
+        n = len(self)
+        order = (self.count - n + np.arange(n)) % len(self.dates)
+        dates = np.empty(rows, dtype='datetime64[s]')
+        block = np.full((rows, cols), np.nan, dtype=self.block.dtype)
+        if rows == len(self.dates):
+            # Only new columns: the rows keep their place in the ring
+            dates[:] = self.dates
+            block[:, :self.block.shape[1]] = self.block
+        else:
+            dates[:n] = self.dates[order]
+            block[:n, :self.block.shape[1]] = self.block[order]
+            self.count = n
+        self.dates = dates
+        self.block = block
+
+
+class RecordingRules:
+    """Declarative selection of the recorded results.
+
+    *rules* is a list of dicts with the keys
+
+    * ``'entity'``: ``fnmatch`` pattern of the source entity, like
+      ``'Battery-*'`` (default ``'*'``),
+    * ``'attr'``: pattern of the attribute (default ``'*'``),
+    * ``'every'``: record only every *every* seconds of simulation time
+      (default: every step),
+    * ``'to'``: list of the outputs that get the values, out of
+      ``'csv'``, ``'parquet'``, ``'database'``, ``'dashboard'`` and
+      ``'mqtt'`` (default: all).
+
+    The first rule that matches a source and attribute applies; values
+    without a matching rule are not recorded.
+    """
+
+    def __init__(self, rules):
+        self.rules = [{'entity': rule.get('entity', '*'), 'attr': rule.get('attr', '*'),
+                       'every': rule.get('every'), 'to': rule.get('to')} for rule in rules]
+        self.keys = {}
+        # Recording interval of the columns of the last batch: 0 every
+        # step, NaN never
+        self._batch_keys = None
+        self._every = None
+
+    def rule(self, src, attr):
+        """Return the rule of the *attr* of *src*, or ``None``."""
+        key = (src, attr)
+        if key not in self.keys:
+            self.keys[key] = next((rule for rule in self.rules
+                                   if fnmatch.fnmatchcase(src, rule['entity'])
+                                   and fnmatch.fnmatchcase(attr, rule['attr'])), None)
+        return self.keys[key]
+
+    def filter(self, seconds, batch):
+        """Return the part of the :class:`StepBatch` *batch* that is
+        recorded at *seconds* since the start."""
+        if batch.keys != self._batch_keys:
+            self._batch_keys = batch.keys
+            rules = [self.rule(*key) for key in batch.keys]
+            self._every = np.array([np.nan if rule is None else rule['every'] or 0
+                                    for rule in rules], dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            keep = (self._every == 0) | (np.fmod(seconds, self._every) == 0)
+        if keep.all():
+            return batch
+        return batch.select(np.flatnonzero(keep))
+
+    def routes(self, key, output):
+        """Return true if the column *key* is written to *output*."""
+        rule = self.rule(*key)
+        return rule is not None and (rule['to'] is None or output in rule['to'])
+
+
+class Route:
+    """Pass only the columns that *rules* route to *output* on to
+    *writer*. Rows without any of these values are left out."""
+
+    def __init__(self, writer, rules, output):
+        self.writer = writer
+        self.rules = rules
+        self.output = output
+
+    def write(self, dates, columns, block):
+        cols = [col for col, key in enumerate(columns) if self.rules.routes(key, self.output)]
+        if not cols:
+            return
+        block = block[:, cols]
+        rows = ~pd.isna(block).all(axis=1)
+        self.writer.write(dates[rows], [columns[col] for col in cols], block[rows])
+
+    def close(self):
+        self.writer.close()
+
+
+class CSVWriter:
+    """Write result blocks to the CSV file *output_file*.
+
+    The file is opened once and gets a header with a ``date`` column
+    followed by one ``<source>-<attribute>`` column per key. Columns that
+    first appear later, like an entity that connects late, are added to the
+    end of the header: the file is rewritten once, in chunks of *chunksize*
+    rows, with empty cells in the rows written before.
+    """
+
+    def __init__(self, output_file, chunksize=100000):
+        self.output_file = output_file
+        self.chunksize = chunksize
+        self.file = None
+        self.header = None
+
+    def write(self, dates, columns, block):
+        df = pd.DataFrame(block, index=pd.DatetimeIndex(dates, name='date'),
+                          columns=[column_name(key) for key in columns])
+        if self.file is None:
+            self.file = open(self.output_file, 'w', newline='')
+            self.header = list(df.columns)
+            df.to_csv(self.file, header=True, date_format=DATE_FORMAT)
+        else:
+            if list(df.columns) != self.header:
+                new = [name for name in df.columns if name not in self.header]
+                if new:
+                    self._extend(new)
+                df = df.reindex(columns=self.header)
+            df.to_csv(self.file, header=False, date_format=DATE_FORMAT)
+        self.file.flush()
+
+    def _extend(self, names):
+        # Rewrite the file with the columns *names* added to the header
+        self.file.close()
+        header = self.header + names
+        tmp = self.output_file + '.tmp'
+        with open(tmp, 'w', newline='') as f:
+            pd.DataFrame(columns=['date'] + header).to_csv(f, index=False)
+            for chunk in pd.read_csv(self.output_file, dtype=str, keep_default_na=False,
+                                     chunksize=self.chunksize):
+                chunk.reindex(columns=['date'] + header, fill_value='').to_csv(
+                    f, header=False, index=False)
+        os.replace(tmp, self.output_file)
+        self.header = header
+        self.file = open(self.output_file, 'a', newline='')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ParquetWriter:
+    """Write result blocks to the Parquet file *output_file*.
+
+    The file has a ``date`` timestamp column and one typed column per key:
+    float64 for numbers, and the type pyarrow infers for other inputs (int,
+    bool, text). A column gets its type from its first values; a column
+    without any value yet has the null type until then. Text in a column of
+    another type makes it a text column. Columns are compressed with
+    *compression*.
+
+    The blocks are collected into row groups of *row_group_size* rows, as
+    row groups of a single flush would be too small to scan efficiently;
+    the last row group is written on :meth:`close`. The file is created
+    with the first row group. If a column shows up or changes its type
+    after that, the row groups written so far are copied into a new file
+    with the new schema.
+
+    Needs the ``pyarrow`` package.
+    """
+
+    def __init__(self, output_file, compression='zstd', row_group_size=16384):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('The Parquet result output requires the pyarrow package.')
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.output_file = output_file
+        self.compression = compression
+        self.file = None
+        self.schema = None
+        # {key: pyarrow type} of the columns, in file order
+        self.types = {}
+        self.row_group_size = row_group_size
+        self.tables = []
+        self.rows = 0
+        self.cast = set()
+
+    def write(self, dates, columns, block):
+        pa = self.pa
+        arrays = [pa.array(dates.astype('datetime64[s]'))]
+        changed = self.schema is None
+        for i, key in enumerate(columns):
+            type = self.types.get(key)
+            if type is None:
+                type = self.types[key] = pa.null()
+                changed = True
+            array = self._array(block[:, i], type)
+            if array.type != type and not pa.types.is_null(array.type):
+                if not pa.types.is_null(type):
+                    print('ParquetWriter: column "%s" has values that are not %s and is stored '
+                          'as text in "%s".' % (column_name(key), type, self.output_file))
+                self.types[key] = array.type
+                changed = True
+            arrays.append(array)
+        self.tables.append(pa.Table.from_arrays(
+            arrays, names=['date'] + [column_name(key) for key in columns]))
+        if changed:
+            self.schema = pa.schema([('date', pa.timestamp('s'))] +
+                                    [(column_name(key), type) for key, type in self.types.items()])
+            if self.file is not None:
+                self._rewrite()
+        self.rows += len(dates)
+        if self.rows >= self.row_group_size:
+            self._write_row_groups()
+
+    def _write_row_groups(self, final=False):
+        table = self.pa.concat_tables([self._conform(table) for table in self.tables])
+        full = len(table) if final else len(table) - len(table) % self.row_group_size
+        if full:
+            if self.file is None:
+                self.file = self.pq.ParquetWriter(self.output_file, self.schema,
+                                                  compression=self.compression)
+            self.file.write_table(table.slice(0, full), row_group_size=self.row_group_size)
+        rest = table.slice(full)
+        self.tables = [rest] if len(rest) else []
+        self.rows = len(rest)
+
+    def _rewrite(self):
+        # Copy the row groups written so far into a file with the new schema
+        self.file.close()
+        old = self.output_file + '.old'
+        os.replace(self.output_file, old)
+        self.file = self.pq.ParquetWriter(self.output_file, self.schema,
+                                          compression=self.compression)
+        with open(old, 'rb') as f:
+            for batch in self.pq.ParquetFile(f).iter_batches(batch_size=self.row_group_size):
+                self.file.write_table(self._conform(self.pa.Table.from_batches([batch])),
+                                      row_group_size=self.row_group_size)
+        os.remove(old)
+
+    def close(self):
+        if self.tables:
+            self._write_row_groups(final=True)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _conform(self, table):
+        # *table* with the columns and types of the schema
+        pa = self.pa
+        arrays = []
+        for field in self.schema:
+            if field.name not in table.column_names:
+                arrays.append(pa.nulls(len(table), field.type))
+                continue
+            array = table.column(field.name)
+            if array.type != field.type:
+                if pa.types.is_string(field.type) and not pa.types.is_null(array.type):
+                    array = self._strings(array.to_pylist())
+                else:
+                    array = array.cast(field.type)
+            arrays.append(array)
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def _array(self, values, type):
+        # The array of the column *values* with the column type *type*; a
+        # different type if the values need one
+        pa = self.pa
+        if pa.types.is_string(type):
+            return self._strings(values.tolist())
+        if pa.types.is_null(type) and values.dtype != object:
+            if np.isnan(values).all():
+                return pa.nulls(len(values))
+            return pa.array(values, type=pa.float64())
+        if values.dtype == object:
+            values = values.tolist()
+        try:
+            if pa.types.is_null(type):
+                return pa.array(values, from_pandas=True)
+            return pa.array(values, type=type, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+        try:
+            array = pa.array(values, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed values, like numbers and text
+            return self._strings(values)
+        if _is_number(pa, array.type) and _is_number(pa, type):
+            # E.g. a float in an int column: stored as the column type
+            name = str(type)
+            if name not in self.cast:
+                self.cast.add(name)
+                print('ParquetWriter: values that are not %s are converted to %s in "%s".' %
+                      (name, name, self.output_file))
+            return array.cast(type, safe=False)
+        return self._strings(values)
+
+    def _strings(self, values):
+        return self.pa.array([None if value is None or (isinstance(value, float) and value != value)
+                              else str(value) for value in values], type=self.pa.string())
+
+
+def _is_number(pa, type):
+    return pa.types.is_integer(type) or pa.types.is_floating(type) or pa.types.is_boolean(type)
+
+
+class SQLiteWriter:
+    """Write result blocks to the SQLite database *db_file*.
+
+    The results are stored in long format in the table ``results`` with
+    the columns ``date`` (``'YYYY-MM-DD HH:MM:SS'``), ``entity``, ``attr``
+    and ``value``, indexed on ``(entity, attr, date)`` and on ``date``.
+    Every block is inserted with one ``executemany`` and committed as one
+    transaction; missing values are not stored, lists and dicts are stored
+    as JSON text. The database runs in WAL mode, so
+    dashboards can query it while the simulation is writing.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        # May be written from the thread of an AsyncWriter
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS results '
+                              '(date TEXT NOT NULL, entity TEXT NOT NULL, attr TEXT NOT NULL, value)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS results_entity_attr_date '
+                              'ON results (entity, attr, date)')
+            # For reads of a date range over all series
+            self.conn.execute('CREATE INDEX IF NOT EXISTS results_date ON results (date)')
+
+    def write(self, dates, columns, block):
+        dates = np.char.replace(np.datetime_as_string(dates.astype('datetime64[s]')), 'T', ' ')
+        rows, cols = np.nonzero(~pd.isna(block))
+        keys = np.array(columns, dtype=object).reshape(len(columns), 2)
+        values = block[rows, cols].tolist()
+        if block.dtype == object:
+            # sqlite3 only binds scalars; lists and the like are stored as JSON
+            values = [value if isinstance(value, (str, int, float, bytes)) else
+                      json.dumps(value, default=str) for value in values]
+        records = zip(dates[rows].tolist(), keys[cols, 0].tolist(), keys[cols, 1].tolist(), values)
+        with self.conn:
+            self.conn.executemany('INSERT INTO results VALUES (?, ?, ?, ?)', records)
+
+    def close(self):
+        self.conn.close()
+
+
+class MQTTWriter:
+    """Publish the results to the topic *mqtt_topic* of the MQTT broker
+    *mqtt_broker* (like ``'mqtt://192.168.10.90:1883'``).
+
+    The paho network loop runs in its own thread (``loop_start``), so
+    publishing only queues the message. Every message carries
+    *batch_steps* steps in the *encoding*:
+
+    * ``'pandas'``: the JSON layout of ``DataFrame.to_json``,
+      ``{"<column>": {"<epoch ms>": value}}``,
+    * ``'json'``: columnar JSON, ``{"time": [<epoch s>, ...],
+      "<column>": [value, ...]}``,
+    * ``'msgpack'``: the columnar layout packed with msgpack (needs the
+      ``msgpack`` package).
+
+    With *per_entity*, every source gets its own topic
+    ``<mqtt_topic>/<source>`` and the columns are the attribute names.
+    Rows are collected over several writes until a batch is full; the last,
+    partial batch is sent on :meth:`close`. Messages are sent with QoS
+    *qos*. *client* replaces the paho client, e.g. by a local stand-in
+    with ``publish``, ``loop_start``, ``loop_stop`` and ``disconnect``
+    (the ``Collector`` passes its ``mqtt_client`` on).
+    """
+
+    def __init__(self, mqtt_broker, mqtt_topic, qos=0, batch_steps=1, encoding='pandas',
+                 per_entity=False, client=None):
+        if encoding not in ('pandas', 'json', 'msgpack'):
+            raise ValueError('Unknown MQTT encoding "%s".' % encoding)
+        if encoding == 'msgpack':
+            import msgpack
+            self.pack = msgpack.packb
+        self.mqtt_topic = mqtt_topic
+        self.qos = qos
+        self.batch_steps = batch_steps
+        self.encoding = encoding
+        self.per_entity = per_entity
+        self.last = None
+        # Rows waiting for a full batch, all with the same columns
+        self.pending = []
+        self.pending_columns = None
+        if client is None:
+            import paho.mqtt.client as mqtt
+
+            client = mqtt.Client()
+            broker_url = urlparse(mqtt_broker)
+            if broker_url.hostname and broker_url.port:
+                client.connect(broker_url.hostname, broker_url.port)
+            else:
+                print('hostname:', broker_url.hostname)
+                print('port:', broker_url.port)
+                raise ValueError('Invalid host.')
+        self.client = client
+        self.client.loop_start()
+
+    def write(self, dates, columns, block):
+        columns = list(columns)
+        if self.pending and columns != self.pending_columns:
+            self.send()
+        self.pending.append((dates, block))
+        self.pending_columns = columns
+        rows = sum(len(dates) for dates, _ in self.pending)
+        if rows >= self.batch_steps:
+            dates = np.concatenate([dates for dates, _ in self.pending])
+            block = np.concatenate([block for _, block in self.pending])
+            full = rows - rows % self.batch_steps
+            self.pending = [(dates[full:], block[full:])] if full < rows else []
+            self.publish(dates[:full], columns, block[:full])
+
+    def send(self):
+        """Publish the rows waiting for a full batch."""
+        if self.pending:
+            dates = np.concatenate([dates for dates, _ in self.pending])
+            block = np.concatenate([block for _, block in self.pending])
+            self.pending = []
+            self.publish(dates, self.pending_columns, block)
+
+    def publish(self, dates, columns, block):
+        """Publish the rows of *block* in messages of *batch_steps* rows."""
+        if self.per_entity:
+            topics = collections.defaultdict(list)
+            for col, (src, attr) in enumerate(columns):
+                topics['%s/%s' % (self.mqtt_topic, src)].append((col, attr))
+        else:
+            topics = {self.mqtt_topic: [(col, column_name(key))
+                                        for col, key in enumerate(columns)]}
+
+        seconds = dates.astype('datetime64[s]').astype(np.int64)
+        values = np.where(pd.isna(block), None, block) if len(block) else block
+        for start in range(0, len(dates), self.batch_steps):
+            stop = start + self.batch_steps
+            for topic, cols in topics.items():
+                payload = self.encode(seconds[start:stop], cols, values[start:stop])
+                self.last = self.client.publish(topic, payload, qos=self.qos)
+
+    def encode(self, seconds, cols, values):
+        """Return the message for the rows *values* at *seconds* and the
+        ``(column, name)`` pairs *cols*."""
+        if self.encoding == 'pandas':
+            stamps = [str(t * 1000) for t in seconds.tolist()]
+            msg = {}
+            for col, name in cols:
+                series = {stamp: value for stamp, value in zip(stamps, values[:, col].tolist())
+                          if value is not None}
+                if series:
+                    msg[name] = series
+            return json.dumps(msg)
+
+        msg = {'time': seconds.tolist()}
+        for col, name in cols:
+            msg[name] = values[:, col].tolist()
+        if self.encoding == 'msgpack':
+            return self.pack(msg)
+        return json.dumps(msg)
+
+    def close(self):
+        try:
+            self.send()
+            if self.last is not None and self.qos > 0:
+                # Wait until the broker acknowledged the queued messages
+                self.last.wait_for_publish(10)
+        finally:
+            self.client.disconnect()
+            self.client.loop_stop()
+
+
+class WandbWriter:
+    """Log the results to wandb, one ``wandb.log`` call with all columns
+    per logged step.
+
+    Every step is logged with ``custom_step``, the number of *step_size*
+    seconds since *start_date*. Only every *every*-th step is logged, and
+    at most one step per *min_interval* seconds (wall clock): a step that
+    comes sooner replaces the one waiting to be logged, so the dashboard
+    always gets the latest values without following every step.
+
+    If no wandb run is active, a run of *project* is started in *mode*:
+    ``'online'``, or ``'offline'`` to log to local files that are
+    uploaded later with ``wandb sync``.
+    """
+
+    def __init__(self, start_date, step_size=900, every=1, min_interval=0,
+                 project='illuminator-project', mode=None):
+        import wandb
+
+        self.wandb = wandb
+        if wandb.run is None:
+            wandb.init(project=project, mode=mode)
+            wandb.define_metric('custom_step')
+            wandb.define_metric('*', step_metric='custom_step')
+        self.start = np.datetime64(start_date, 's')
+        self.step_size = step_size
+        self.every = every
+        self.min_interval = min_interval
+        self.last_log = None
+        self.waiting = None
+
+    def write(self, dates, columns, block):
+        names = [column_name(key) for key in columns]
+        steps = (dates.astype('datetime64[s]') - self.start).astype(np.int64) / self.step_size
+        rows = np.flatnonzero(np.round(steps).astype(np.int64) % self.every == 0)
+        if self.min_interval > 0:
+            # Only the latest step can still be logged
+            rows = rows[-1:]
+        missing = pd.isna(block)
+        for row in rows:
+            self.waiting = {name: value for name, value, isna
+                            in zip(names, block[row].tolist(), missing[row]) if not isna}
+            self.waiting['custom_step'] = float(steps[row])
+            if self.min_interval <= 0:
+                self._log()
+        if self.waiting is not None and (self.last_log is None or
+                                         walltime.monotonic() - self.last_log >= self.min_interval):
+            self._log()
+
+    def close(self):
+        if self.waiting is not None:
+            self._log()
+
+    def _log(self):
+        self.wandb.log(self.waiting)
+        self.waiting = None
+        self.last_log = walltime.monotonic()
+
+
+class Aggregator:
+    """Aggregate the result blocks over windows of *window* seconds and pass
+    the aggregates on to the *writers*.
+
+    *rules* maps ``fnmatch`` patterns of the column names
+    (``<source>-<attribute>``) to one of the methods ``'mean'``, ``'min'``,
+    ``'max'``, ``'sum'``, ``'last'`` or ``'raw'``; the first matching
+    pattern applies. Columns without a matching pattern are kept ``'raw'``,
+    at full resolution. Missing values are skipped, non-numeric columns are
+    aggregated with ``'last'``. Columns of ints or bools stay ints or bools
+    with ``'last'``, ``'min'``, ``'max'`` and ``'raw'``.
+
+    The windows are aligned to midnight and an aggregate is dated at the
+    start of its window. If any column is kept raw, the aggregates are
+    added to the rows at full resolution.
+    """
+
+    METHODS = ('mean', 'min', 'max', 'sum', 'last', 'raw')
+
+    def __init__(self, writers, window, rules=None):
+        self.writers = list(writers)
+        self.window = int(window)
+        self.rules = list((rules or {'*': 'mean'}).items())
+        for pattern, method in self.rules:
+            if method not in self.METHODS:
+                raise ValueError('Unknown aggregation "%s" for "%s".' % (method, pattern))
+        self.keys = {}
+        self.methods = {}
+        self.pending = None
+
+    def method(self, name):
+        """Return the aggregation method of the column *name*."""
+        if name not in self.methods:
+            self.methods[name] = next((method for pattern, method in self.rules
+                                       if fnmatch.fnmatchcase(name, pattern)), 'raw')
+        return self.methods[name]
+
+    def write(self, dates, columns, block):
+        names = [column_name(key) for key in columns]
+        self.keys.update(zip(names, columns))
+        df = pd.DataFrame(block, index=pd.DatetimeIndex(dates), columns=names)
+        if self.pending is not None:
+            df = pd.concat([self.pending, df])
+        windows = df.index.values.astype('datetime64[s]').astype(np.int64) // self.window
+        done = windows < windows[-1]
+        self.pending = df[~done]
+        if done.any():
+            self._write(df[done], windows[done])
+
+    def close(self):
+        try:
+            if self.pending is not None and len(self.pending):
+                windows = (self.pending.index.values.astype('datetime64[s]').astype(np.int64)
+                           // self.window)
+                self._write(self.pending, windows)
+                self.pending = None
+        finally:
+            for writer in self.writers:
+                writer.close()
+
+    def _write(self, df, windows):
+        # Columns of ints or bools are aggregated as floats; 'last', 'min',
+        # 'max' and 'raw' hand them out as ints or bools again
+        kinds = {}
+        for name in df.columns:
+            if self.method(name) in ('last', 'min', 'max', 'raw') and df[name].dtype == object:
+                values = df[name].dropna()
+                kind = type(values.iloc[0]) if len(values) else None
+                if kind in (int, bool) and values.map(type).eq(kind).all():
+                    kinds[name] = kind
+        df = df.astype({name: np.float64 for name in kinds}).infer_objects()
+        aggs = {}
+        raw = []
+        for name in df.columns:
+            method = self.method(name)
+            if method == 'raw':
+                raw.append(name)
+            elif method == 'last' or pd.api.types.is_numeric_dtype(df[name]):
+                aggs[name] = method
+            else:
+                aggs[name] = 'last'
+
+        grouped = df[list(aggs)].groupby(windows)
+        out = grouped.agg(aggs) if aggs else pd.DataFrame(index=np.unique(windows))
+        if 'sum' in aggs.values():
+            # A window without any value has no sum
+            counts = grouped.count()
+            for name, method in aggs.items():
+                if method == 'sum':
+                    out.loc[counts[name] == 0, name] = np.nan
+        out.index = (out.index.values * self.window).astype('datetime64[s]')
+        if raw:
+            out = pd.concat([df[raw], out], axis=1).sort_index()
+        out = out[[name for name in df.columns if name in out.columns]]
+        for name, kind in kinds.items():
+            column = out[name].astype(object)
+            present = column.notna()
+            column[present] = [kind(value) for value in column[present]]
+            out[name] = column
+
+        dates = out.index.values.astype('datetime64[s]')
+        columns = [self.keys[name] for name in out.columns]
+        block = out.to_numpy()
+        for writer in self.writers:
+            writer.write(dates, columns, block)
+
+
+class ChangeFilter:
+    """Pass only changed values on to the *writers* (run-length encoding).
+
+    A value is written when it differs by more than *tolerance* from the
+    last written value of its column; other values are replaced by ``NaN``
+    and rows without any written value are left out. The last written
+    value holds until the next one, which is how :func:`read_results` with
+    ``dense=True`` rebuilds the full series. Missing values are not
+    changes: a value that goes missing is not recorded, so the dense series
+    carries the last value forward until the next one comes in.
+
+    The last row is held back until the next block comes in, and written
+    in full on :meth:`close`, so the results end at the last step of the
+    run even if nothing changed then.
+    """
+
+    def __init__(self, writers, tolerance=0):
+        self.writers = list(writers)
+        self.tolerance = tolerance
+        self.last = {}
+        self.held = None
+
+    def write(self, dates, columns, block):
+        if self.held is not None:
+            held_dates, held_columns, held_block = self.held
+            if held_columns == list(columns):
+                dates = np.concatenate([held_dates, dates])
+                block = np.concatenate([held_block, block])
+            else:
+                self._write(held_dates, held_columns, held_block)
+        self.held = (dates[-1:], list(columns), block[-1:])
+        if len(dates) > 1:
+            self._write(dates[:-1], columns, block[:-1])
+
+    def _write(self, dates, columns, block, full=False):
+        last = np.array([self.last.get(key, np.nan) for key in columns], dtype=block.dtype)
+        out = np.full(block.shape, np.nan, dtype=block.dtype)
+        numeric = block.dtype != object
+        for values, changes in zip(block, out):
+            present = ~pd.isna(values)
+            if full:
+                changed = present
+            elif numeric:
+                with np.errstate(invalid='ignore'):
+                    changed = present & ~(np.abs(values - last) <= self.tolerance)
+            else:
+                changed = present & np.array([pd.isna(old) or bool(old != new)
+                                              for old, new in zip(last, values)], dtype=bool)
+            changes[changed] = values[changed]
+            last[changed] = values[changed]
+        self.last.update(zip(columns, last.tolist()))
+
+        rows = ~pd.isna(out).all(axis=1)
+        if rows.any():
+            for writer in self.writers:
+                writer.write(dates[rows], columns, out[rows])
+
+    def close(self):
+        if self.held is not None:
+            self._write(*self.held, full=True)
+            self.held = None
+        for writer in self.writers:
+            writer.close()
+
+
+class AsyncWriter:
+    """Run the *writers* in a background thread.
+
+    :meth:`write` only queues the block, at most *maxsize* blocks are
+    queued. When the queue is full, *backpressure* decides what happens:
+
+    * ``'block'``: wait until the thread has written a block,
+    * ``'drop-oldest'``: drop the oldest queued block,
+    * ``'spill'``: store the block in a temporary file in *spill_dir* (the
+      system temp directory by default) until the thread gets to it.
+
+    The blocks are written in order. An error of a writer is raised again
+    by the next :meth:`write` or by :meth:`close`, which waits until all
+    queued blocks are written and closes the writers.
+    """
+
+    def __init__(self, writers, maxsize=8, backpressure='block', spill_dir=None):
+        if backpressure not in ('block', 'drop-oldest', 'spill'):
+            raise ValueError('Unknown backpressure "%s".' % backpressure)
+        self.writers = list(writers)
+        self.maxsize = maxsize
+        self.backpressure = backpressure
+        self.spill_dir = spill_dir
+        self.spill_path = None
+        self.queue = collections.deque()
+        self.spilled = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.error = None
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, dates, columns, block):
+        self._check()
+        record = (dates, columns, block)
+        with self.cond:
+            if len(self.queue) >= self.maxsize:
+                if self.backpressure == 'block':
+                    while len(self.queue) >= self.maxsize and self.error is None:
+                        self.cond.wait()
+                    self._check()
+                elif self.backpressure == 'drop-oldest':
+                    self.queue.popleft()
+                    self.dropped += 1
+                    if self.dropped == 1:
+                        print('AsyncWriter: the writers fall behind, dropping results.')
+            if self.backpressure == 'spill' and (self.spilled or len(self.queue) >= self.maxsize):
+                # Keep the order: once spilling, every block goes through the disk
+                self.spilled.append(self._spill(record))
+            else:
+                self.queue.append(record)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        if self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+        if self.dropped:
+            print('AsyncWriter: dropped %d result blocks.' % self.dropped)
+        try:
+            self._check()
+        finally:
+            for writer in self.writers:
+                writer.close()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('A result writer failed.') from self.error
+
+    def _spill(self, record):
+        if self.spill_path is None:
+            self.spill_path = tempfile.mkdtemp(prefix='illuminator-spill-', dir=self.spill_dir)
+        fd, path = tempfile.mkstemp(suffix='.pickle', dir=self.spill_path)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+        return path
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not (self.queue or self.spilled or self.closed):
+                    self.cond.wait()
+                if self.queue:
+                    record, path = self.queue.popleft(), None
+                elif self.spilled:
+                    record, path = None, self.spilled.popleft()
+                else:
+                    return
+                self.cond.notify_all()
+            try:
+                if path is not None:
+                    with open(path, 'rb') as f:
+                        record = pickle.load(f)
+                    os.remove(path)
+                for writer in self.writers:
+                    writer.write(*record)
+            except Exception as e:
+                with self.cond:
+                    self.error = e
+                    self.queue.clear()
+                    self.spilled.clear()
+                    self.cond.notify_all()
+                return
+
+
+def _select(names, columns):
+    # Column names matching the names or fnmatch patterns in *columns*
+    if columns is None:
+        return list(names)
+    if isinstance(columns, str):
+        columns = [columns]
+    return [name for name in names if any(fnmatch.fnmatchcase(name, c) for c in columns)]
+
+
+def read_results(path, columns=None, start=None, end=None, chunksize=100000, dense=False,
+                 step_size=None):
+    """Load results written by the collector into a DataFrame indexed by
+    date.
+
+    *columns* selects columns by name or ``fnmatch`` pattern, like
+    ``'Battery-*-soc'``; *start* and *end* (dates, both included) select
+    rows. Only the selected data is loaded: a Parquet file skips the
+    columns and row groups that are not needed, a SQLite database (``.db``)
+    is queried through its index, a CSV file is parsed in chunks of
+    *chunksize* rows.
+
+    With *dense*, results recorded with ``changes_only`` are filled in: a
+    value holds until the next recorded value or the last step of the run
+    (which is always recorded), also over steps where it was missing, and with *step_size* the rows are completed
+    to one every *step_size* seconds up to that step. The value at
+    *start* is only known if the file is read from its first row on, so
+    a dense read loads everything before *end*.
+    """
+    if dense:
+        df = read_results(path, columns, None, end, chunksize).ffill()
+        if step_size and len(df):
+            grid = pd.date_range(df.index[0], df.index[-1], freq='%ds' % step_size, name='date')
+            df = df.reindex(df.index.union(grid)).ffill()
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start)]
+        return df
+
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    if os.path.splitext(path)[1] == '.db':
+        return _read_sqlite(path, columns, start, end)
+    if os.path.splitext(path)[1] == '.parquet':
+        import pyarrow.parquet as pq
+
+        names = pq.read_schema(path).names[1:]
+        filters = []
+        if start is not None:
+            filters.append(('date', '>=', start))
+        if end is not None:
+            filters.append(('date', '<=', end))
+        table = pq.read_table(path, columns=['date'] + _select(names, columns),
+                              filters=filters or None)
+        return table.to_pandas().set_index('date')
+
+    chunks = []
+    for chunk in iter_results(path, columns, chunksize):
+        if start is not None:
+            chunk = chunk[chunk.index >= start]
+        if end is not None:
+            if len(chunk) and chunk.index[0] > end:
+                break
+            chunk = chunk[chunk.index <= end]
+        chunks.append(chunk)
+    if not chunks:
+        names = _select(pd.read_csv(path, nrows=0).columns[1:], columns)
+        return pd.DataFrame(columns=names, index=pd.DatetimeIndex([], name='date'))
+    return pd.concat(chunks)
+
+
+def iter_results(path, columns=None, chunksize=100000):
+    """Yield the results in *path* (see :func:`read_results`) as
+    DataFrames of about *chunksize* rows, in date order.
+
+    Only one chunk is held in memory at a time, so this is the way to
+    process the results of long runs with many entities.
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+
+        f = pq.ParquetFile(path)
+        usecols = ['date'] + _select(f.schema_arrow.names[1:], columns)
+        for batch in f.iter_batches(batch_size=chunksize, columns=usecols):
+            yield batch.to_pandas().set_index('date')
+    elif ext == '.db':
+        conn = sqlite3.connect(path)
+        try:
+            series = conn.execute('SELECT DISTINCT entity, attr FROM results').fetchall()
+            names = _select(sorted(column_name(key) for key in series), columns)
+            dates = [row[0] for row in conn.execute('SELECT DISTINCT date FROM results ORDER BY date')]
+            for i in range(0, len(dates), chunksize):
+                chunk = pd.read_sql_query(
+                    'SELECT date, entity, attr, value FROM results WHERE date BETWEEN ? AND ?',
+                    conn, params=[dates[i], dates[min(i + chunksize, len(dates)) - 1]],
+                    parse_dates=['date'])
+                chunk['name'] = chunk['entity'] + '-' + chunk['attr']
+                chunk = chunk.pivot_table(index='date', columns='name', values='value',
+                                          aggfunc='last')
+                yield chunk.reindex(columns=names).rename_axis(None, axis=1)
+        finally:
+            conn.close()
+    else:
+        names = pd.read_csv(path, nrows=0).columns[1:]
+        usecols = ['date'] + _select(names, columns)
+        for chunk in pd.read_csv(path, usecols=usecols, parse_dates=['date'], index_col='date',
+                                 chunksize=chunksize):
+            yield chunk[usecols[1:]]
+
+
+def _read_sqlite(path, columns, start, end):
+    conn = sqlite3.connect(path)
+    try:
+        series = conn.execute('SELECT DISTINCT entity, attr FROM results').fetchall()
+        names = {column_name(key): key for key in series}
+        frames = []
+        for name in _select(sorted(names), columns):
+            query = 'SELECT date, value FROM results WHERE entity = ? AND attr = ?'
+            params = list(names[name])
+            if start is not None:
+                query += ' AND date >= ?'
+                params.append(str(start))
+            if end is not None:
+                query += ' AND date <= ?'
+                params.append(str(end))
+            frame = pd.read_sql_query(query + ' ORDER BY date', conn, params=params,
+                                      parse_dates=['date'], index_col='date')
+            # A database written by several runs has a value per run; the
+            # last one is kept
+            frame = frame[~frame.index.duplicated(keep='last')]
+            frames.append(frame['value'].rename(name))
+    finally:
+        conn.close()
+    if not frames:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='date'))
+    return pd.concat(frames, axis=1)
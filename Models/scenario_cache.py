@@ -0,0 +1,634 @@
+"""
+Binary cache for the text scenario files in ``Scenarios/``.
+
+A datafile is parsed once and stored as two ``.npy`` arrays: the timestamps
+as int64 epoch seconds and the attributes as a float64 matrix (one column
+per attribute). Later runs memory-map these arrays instead of parsing the
+text again. The cache entry is keyed by a hash of the file content and the
+parse options, so an edited datafile is converted again automatically.
+
+For reading the text file directly, an offset index (timestamp -> byte
+offset of the row) can be stored next to the cache entries. It lets a reader
+binary-search the start date and seek to it instead of parsing every row.
+
+The cache entries double as a read-only shared store: every simulator on a
+host that memory-maps the same entry shares its pages through the OS page
+cache, so a year-long series is held in RAM once per host rather than once
+per process. Set the ``ILLUMINATOR_SCENARIO_CACHE`` environment variable to
+a tmpfs directory such as ``/dev/shm/illuminator-scenarios`` to keep the
+store in RAM and off the SD card.
+
+Datafiles may be compressed with gzip (``.gz``), bzip2 (``.bz2``), xz
+(``.xz``) or zstandard (``.zst``, needs the ``zstandard`` package); they are
+decompressed while streaming. A compressed file made of independent blocks
+(see :func:`compress_datafile`) keeps the start-date seek cheap: the offset
+index then stores the block of every row and the row offset inside the
+block, so only one block is decompressed to reach the start date.
+
+"""
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import shutil
+import tempfile
+import zlib
+
+import arrow
+import numpy as np
+import pandas as pd
+
+
+__version__ = '2'
+
+CACHE_DIR_NAME = '.scenario_cache'
+"""Name of the cache directory created next to the datafiles."""
+
+CACHE_DIR_ENV = 'ILLUMINATOR_SCENARIO_CACHE'
+"""Environment variable that overrides the default cache directory."""
+
+DEFAULT_DATE_FORMAT = 'YYYY-MM-DD HH:mm:ss'
+
+COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd'}
+"""Compressed datafile extensions and their compression."""
+
+# Entries already attached by this process, by entry directory
+_attached = {}
+
+
+class ScenarioData:
+    """Parsed content of one scenario datafile.
+
+    *times* is an int64 array with the epoch seconds of each row and
+    *values* a float64 matrix with one row per timestamp and one column per
+    entry in *attrs*. Both may be read-only memory maps.
+    """
+
+    def __init__(self, modelname, attrs, times, values):
+        self.modelname = modelname
+        self.attrs = list(attrs)
+        self.times = times
+        self.values = values
+
+    def __len__(self):
+        return len(self.times)
+
+
+class ScenarioView:
+    """Virtual time-shifted, resampled or looped view on a :class:`ScenarioData`.
+
+    *offset* shifts the series by that many seconds: the view has at date
+    ``d`` the value the data has at ``d - offset``. *step_size* resamples
+    the series to a grid of that many seconds, starting at the first
+    (shifted) timestamp. Each row of the data holds until the next row, and
+    *how* sets how a grid step is filled:
+
+    - ``'mean'``: time-weighted mean over the step,
+    - ``'sum'``: the values are amounts per data row; they are added up
+      over the step, or split if the step is shorter than a row,
+    - ``'interpolate'``: linear interpolation at the start of the step.
+
+    With *repeat*, the series is looped forever. Rows are computed from the
+    underlying arrays on demand; the view never copies the whole series.
+    """
+
+    def __init__(self, data, offset=0, step_size=None, how='mean', repeat=False):
+        if how not in ('mean', 'sum', 'interpolate'):
+            raise ValueError('Invalid resample method "%s"' % how)
+        if step_size is not None and step_size <= 0:
+            raise ValueError('step_size must be positive.')
+        if len(data) == 0:
+            raise ValueError('Empty scenario data.')
+        self.data = data
+        self.modelname = data.modelname
+        self.attrs = data.attrs
+        self.offset = int(offset)
+        self.step_size = None if step_size is None else int(step_size)
+        self.how = how
+        self.repeat = repeat
+
+        times = data.times
+        if len(times) > 1:
+            self.native_step = int(np.median(np.diff(times)))
+        else:
+            self.native_step = self.step_size or 1
+        self.first = int(times[0])
+        # The last row holds for one native step
+        self.end = int(times[-1]) + self.native_step
+        self.period = self.end - self.first
+
+    def find(self, date):
+        """Return the position of the first row at or after *date*, or
+        ``None`` if there is none."""
+        n = len(self.data)
+        if self.step_size is None:
+            cycle, local = 0, date - self.offset - self.first
+            if self.repeat:
+                cycle, local = divmod(local, self.period)
+            k = cycle * n + int(self.data.times.searchsorted(local + self.first))
+        else:
+            k = -(-(date - self.offset - self.first) // self.step_size)
+            if not self.repeat:
+                k = max(k, 0)
+        return k if self.date(k) is not None else None
+
+    def date(self, k):
+        """Return the date of row *k*, or ``None`` if it is past the end."""
+        if self.step_size is None:
+            cycle, i = divmod(k, len(self.data))
+            if cycle and not self.repeat:
+                return None
+            return int(self.data.times[i]) + cycle * self.period + self.offset
+
+        date = self.first + self.offset + k * self.step_size
+        if not self.repeat:
+            if self.how == 'interpolate':
+                last = int(self.data.times[-1]) + self.offset
+            else:
+                last = self.end + self.offset - self.step_size
+            if date > last:
+                return None
+        return date
+
+    def row(self, k):
+        """Return the values of row *k* as an array (a view on the data if
+        the series is not resampled)."""
+        if self.step_size is None:
+            return self.data.values[k % len(self.data)]
+
+        start = self.first + k * self.step_size
+        if self.how == 'interpolate':
+            return self._interpolate(start)
+        total = self._integral(start, start + self.step_size)
+        if self.how == 'mean':
+            return total / self.step_size
+        return total / self.native_step
+
+    def horizon(self, k, n, attrs=None):
+        """Return the dates and values of the *n* rows starting at row *k*.
+
+        The values are returned as a dict of one array per attribute in
+        *attrs* (default: all). Rows past the end of the data are left out.
+        If the series is not resampled and the rows do not wrap around a
+        loop, the arrays are views on the data and nothing is copied.
+        """
+        attrs = self.attrs if attrs is None else attrs
+        cols = [self.attrs.index(attr) for attr in attrs]
+        if self.step_size is None:
+            size = len(self.data)
+            cycle, i = divmod(k, size)
+            if i + n <= size or not self.repeat:
+                if cycle and not self.repeat:
+                    i = size
+                stop = min(i + n, size)
+                dates = self.data.times[i:stop]
+                shift = cycle * self.period + self.offset
+                if shift:
+                    dates = dates + shift
+                return dates, {attr: self.data.values[i:stop, col]
+                               for attr, col in zip(attrs, cols)}
+
+        rows = []
+        dates = []
+        for j in range(k, k + n):
+            date = self.date(j)
+            if date is None:
+                break
+            dates.append(date)
+            rows.append(self.row(j))
+        values = np.array(rows, dtype=np.float64).reshape(len(rows), len(self.attrs))
+        return (np.array(dates, dtype=np.int64),
+                {attr: values[:, col] for attr, col in zip(attrs, cols)})
+
+    def _interpolate(self, date):
+        times = self.data.times
+        values = self.data.values
+        cycle, local = divmod(date - self.first, self.period)
+        local += self.first
+        j = int(times.searchsorted(local, 'right')) - 1
+        if j + 1 < len(times):
+            t1, v1 = times[j + 1], values[j + 1]
+        elif self.repeat:
+            t1, v1 = self.end, values[0]
+        else:
+            return np.array(values[j])
+        return values[j] + (local - times[j]) / (t1 - times[j]) * (v1 - values[j])
+
+    def _integral(self, start, end):
+        # Integral of the step-wise constant series over [start, end)
+        times = self.data.times
+        values = self.data.values
+        total = np.zeros(len(self.attrs))
+        while start < end:
+            a = (start - self.first) % self.period
+            b = min(a + end - start, self.period)
+            start += b - a
+            a += self.first
+            b += self.first
+            j0 = int(times.searchsorted(a, 'right')) - 1
+            j1 = int(times.searchsorted(b, 'left'))
+            if j1 < len(times):
+                nxt = times[j0 + 1:j1 + 1]
+            else:
+                nxt = np.append(times[j0 + 1:], self.end)
+            durations = np.minimum(nxt, b) - np.maximum(times[j0:j1], a)
+            total += durations @ values[j0:j1]
+        return total
+
+
+def parse_header(datafile, delimiter=','):
+    """Read the model name and attribute names from an open *datafile*.
+
+    The first line holds the model name, the second the column names. The
+    first column is the time column and is skipped. Optional ``#`` comments
+    are stripped from the attribute names.
+    """
+    modelname = next(datafile).strip()
+    attrs = next(datafile).strip().split(delimiter)[1:]
+    for i, attr in enumerate(attrs):
+        try:
+            # Try stripping comments
+            attr = attr[:attr.index('#')]
+        except ValueError:
+            pass
+        attrs[i] = attr.strip()
+    return modelname, attrs
+
+
+def parse_times(dates, date_format=DEFAULT_DATE_FORMAT):
+    """Convert a list of date strings to an int64 array of epoch seconds."""
+    if date_format == DEFAULT_DATE_FORMAT:
+        # numpy parses ISO dates natively, which is much faster than arrow
+        return np.array(dates, dtype='datetime64[s]').astype(np.int64)
+    return np.array([arrow.get(d, date_format).int_timestamp for d in dates],
+                    dtype=np.int64)
+
+
+def compression(datafile):
+    """Return the compression of *datafile* by its extension, or ``None``."""
+    return COMPRESSIONS.get(os.path.splitext(datafile)[1].lower())
+
+
+def base_name(datafile):
+    """Return *datafile* without its compression extension."""
+    if compression(datafile):
+        return os.path.splitext(datafile)[0]
+    return datafile
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('Reading .zst datafiles requires the zstandard package.')
+    return zstandard
+
+
+def _decompressor(kind):
+    if kind == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if kind == 'bz2':
+        return bz2.BZ2Decompressor()
+    if kind == 'xz':
+        return lzma.LZMADecompressor()
+    return _zstd().ZstdDecompressor().decompressobj()
+
+
+class _CompressedFile(io.BufferedReader):
+    # Buffered decompressing stream that also closes the underlying file
+    def __init__(self, f, stream):
+        super().__init__(stream)
+        self._file = f
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._file.close()
+
+
+def open_binary(datafile, offset=0):
+    """Open *datafile* for reading bytes, decompressing it if needed.
+
+    Reading starts at the byte *offset* of the file on disk. For a
+    compressed file this must be the start of a block (a gzip member, bzip2
+    or xz stream, or zstandard frame); the stream then continues through
+    all following blocks.
+    """
+    kind = compression(datafile)
+    f = open(datafile, 'rb')
+    if kind is None:
+        f.seek(offset)
+        return f
+    try:
+        f.seek(offset)
+        if kind == 'gzip':
+            stream = gzip.GzipFile(fileobj=f)
+        elif kind == 'bz2':
+            stream = bz2.BZ2File(f)
+        elif kind == 'xz':
+            stream = lzma.LZMAFile(f)
+        else:
+            stream = _zstd().ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        return _CompressedFile(f, stream)
+    except Exception:
+        f.close()
+        raise
+
+
+def _blocks(f, kind, size=1 << 20):
+    # Yield (offset, data) for the decompressed content of the raw file *f*,
+    # where *offset* is the position in *f* of the block the data is from
+    d = _decompressor(kind)
+    start = pos = 0
+    pending = b''
+    while True:
+        chunk = pending or f.read(size)
+        if not chunk:
+            return
+        data = d.decompress(chunk)
+        if d.eof:
+            # A block ends in this chunk; the rest starts the next one
+            pending = d.unused_data
+            pos += len(chunk) - len(pending)
+            yield start, data
+            start = pos
+            d = _decompressor(kind)
+        else:
+            pending = b''
+            pos += len(chunk)
+            yield start, data
+
+
+def compress_datafile(src, dst=None, block_rows=4096, level=None):
+    """Write a compressed copy of the text datafile *src* to *dst*.
+
+    The compression follows the extension of *dst* (default ``src + '.gz'``).
+    The header and every *block_rows* data rows are compressed as an
+    independent block, so readers can seek to the start date without
+    decompressing the whole file. Returns *dst*.
+    """
+    dst = dst or src + '.gz'
+    kind = compression(dst)
+    if kind == 'gzip':
+        compress = (lambda data: gzip.compress(data, 9 if level is None else level, mtime=0))
+    elif kind == 'bz2':
+        compress = (lambda data: bz2.compress(data, 9 if level is None else level))
+    elif kind == 'xz':
+        compress = (lambda data: lzma.compress(data, preset=level))
+    elif kind == 'zstd':
+        compress = _zstd().ZstdCompressor(level=3 if level is None else level).compress
+    else:
+        raise ValueError('Unknown compression extension of "%s".' % dst)
+
+    with open_binary(src) as f, open(dst + '.tmp', 'wb') as out:
+        out.write(compress(f.readline() + f.readline()))
+        while True:
+            rows = [line for _, line in zip(range(block_rows), f)]
+            if not rows:
+                break
+            out.write(compress(b''.join(rows)))
+    os.replace(dst + '.tmp', dst)
+    return dst
+
+
+def parse(datafile, date_format=DEFAULT_DATE_FORMAT, delimiter=','):
+    """Parse the text *datafile* into an in-memory :class:`ScenarioData`."""
+    with io.TextIOWrapper(open_binary(datafile)) as f:
+        modelname, attrs = parse_header(f, delimiter)
+        dates = []
+        rows = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = line.split(delimiter)
+            dates.append(row[0])
+            rows.append(row[1:])
+
+    times = parse_times(dates, date_format)
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), len(attrs))
+    return ScenarioData(modelname, attrs, times, values)
+
+
+def parse_profile(profile_file):
+    """Parse a load profile table as used by ``LoadinNetSim``.
+
+    The table is a CSV or Excel file with a ``Time`` column (day-first
+    dates) followed by one column per load. The load names are returned as
+    the attributes.
+    """
+    if base_name(profile_file).endswith('csv'):
+        pf = pd.read_csv(profile_file)
+    else:
+        pf = pd.read_excel(profile_file)
+    times = pd.to_datetime(pf['Time'], dayfirst=True).to_numpy(dtype='datetime64[s]')
+    values = pf.drop(['Time'], axis=1)
+    return ScenarioData('', values.columns, times.astype(np.int64),
+                        values.to_numpy(dtype=np.float64))
+
+
+def file_key(datafile, *options):
+    """Return the cache key of *datafile*.
+
+    The key is a hash of the file content together with the parse *options*
+    and the cache format version.
+    """
+    h = hashlib.sha1()
+    with open(datafile, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    h.update(('\0'.join(list(options) + [__version__])).encode())
+    return h.hexdigest()
+
+
+def entry_path(datafile, key, cache_dir=None):
+    """Return the directory of the cache entry for *datafile*."""
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(datafile)), CACHE_DIR_NAME)
+    name = os.path.basename(datafile).split('.')[0]
+    return os.path.join(cache_dir, '%s-%s' % (name, key[:16]))
+
+
+def write(path, data):
+    """Store *data* as a cache entry in the directory *path*.
+
+    The entry is written to a temporary directory first and then renamed,
+    so simulators that start at the same time never see a partial entry.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+    try:
+        np.save(os.path.join(tmp, 'times.npy'), np.asarray(data.times, dtype=np.int64))
+        np.save(os.path.join(tmp, 'values.npy'), np.asarray(data.values, dtype=np.float64))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'modelname': data.modelname, 'attrs': data.attrs}, f)
+        # The cache is shared by the simulators of all users; mkdtemp only
+        # gives access to the owner
+        os.chmod(tmp, 0o755)
+        os.rename(tmp, path)
+    except OSError:
+        # Another process was faster, or the directory is not writable
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+
+
+def read(path):
+    """Memory-map the cache entry in the directory *path* read-only.
+
+    An entry is only mapped once per process; later calls return the same
+    :class:`ScenarioData`.
+    """
+    if path in _attached:
+        return _attached[path]
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    times = np.load(os.path.join(path, 'times.npy'), mmap_mode='r')
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+    data = ScenarioData(meta['modelname'], meta['attrs'], times, values)
+    _attached[path] = data
+    return data
+
+
+def _lines(datafile):
+    # Yield (block, offset, line) for every line of *datafile*, where
+    # *offset* is the position of the line in the decompressed *block*. In
+    # an uncompressed file, every line is its own block.
+    kind = compression(datafile)
+    with open(datafile, 'rb') as f:
+        if kind is None:
+            offset = 0
+            for line in f:
+                yield offset, 0, line
+                offset += len(line)
+            return
+
+        block = pos = 0
+        at = (0, 0)
+        tail = b''
+        for start, data in _blocks(f, kind):
+            if start != block:
+                block, pos = start, 0
+                if not tail:
+                    at = (block, 0)
+            i = 0
+            while True:
+                j = data.find(b'\n', i) + 1
+                if not j:
+                    break
+                yield at[0], at[1], tail + data[i:j]
+                tail = b''
+                i = j
+                at = (block, pos + i)
+            tail += data[i:]
+            pos += len(data)
+        if tail:
+            yield at[0], at[1], tail
+
+
+def build_index(datafile, date_format=DEFAULT_DATE_FORMAT, delimiter=','):
+    """Return an ``(n, 3)`` int64 array with the timestamp, the block offset
+    and the offset inside the block of every data row in *datafile*.
+
+    For an uncompressed file, the block offset is the byte offset of the row
+    and the offset inside the block is 0. For a compressed file, the block
+    offset is the position of the compressed block that holds the row, and
+    the offset inside the block counts decompressed bytes.
+    """
+    dates = []
+    offsets = []
+    lines = _lines(datafile)
+    sep = delimiter.encode()
+    for i, (block, offset, line) in enumerate(lines):
+        if i >= 2 and line.strip():
+            dates.append(line.split(sep, 1)[0].strip().decode())
+            offsets.append((block, offset))
+
+    index = np.empty((len(dates), 3), dtype=np.int64)
+    index[:, 0] = parse_times(dates, date_format)
+    index[:, 1:] = np.array(offsets, dtype=np.int64).reshape(len(offsets), 2)
+    return index
+
+
+def load_index(datafile, date_format=DEFAULT_DATE_FORMAT, delimiter=',', cache_dir=None):
+    """Return the offset index of *datafile* (see :func:`build_index`).
+
+    The index is persisted in the cache directory and memory-mapped on
+    later calls.
+    """
+    key = file_key(datafile, date_format, delimiter)
+    path = entry_path(datafile, key, cache_dir) + '.index.npy'
+    if os.path.isfile(path):
+        return np.load(path, mmap_mode='r')
+
+    index = build_index(datafile, date_format, delimiter)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix='.tmp-', suffix='.npy', dir=os.path.dirname(path))
+    except OSError:
+        # The index is only kept for this run
+        return index
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, index)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except OSError:
+        os.remove(tmp)
+    return index
+
+
+def load(datafile, date_format=DEFAULT_DATE_FORMAT, delimiter=',', cache_dir=None):
+    """Return the :class:`ScenarioData` of *datafile*, using the cache.
+
+    The text file is only parsed if no cache entry exists for its current
+    content. If the cache directory cannot be written, the parsed data is
+    returned without being cached.
+    """
+    key = file_key(datafile, date_format, delimiter)
+    return _load(entry_path(datafile, key, cache_dir),
+                 lambda: parse(datafile, date_format, delimiter))
+
+
+def load_profile(profile_file, cache_dir=None):
+    """Return the :class:`ScenarioData` of a ``LoadinNetSim`` profile table,
+    using the cache (see :func:`parse_profile`)."""
+    key = file_key(profile_file, 'profile')
+    return _load(entry_path(profile_file, key, cache_dir),
+                 lambda: parse_profile(profile_file))
+
+
+def horizon(datafile, start, n, attrs=None, date_format=DEFAULT_DATE_FORMAT, delimiter=',',
+            cache_dir=None, **view):
+    """Return the next *n* rows of *datafile* from the date *start* on.
+
+    This is the look-ahead query for agents and controllers that need a
+    forecast of the scenario inputs: it reads the shared cache directly,
+    without a mosaik simulator in between. *start* is a date string in
+    *date_format* and *view* takes the options of :class:`ScenarioView`.
+    Returns ``(dates, values)`` like :meth:`ScenarioView.horizon`.
+    """
+    data = ScenarioView(load(datafile, date_format, delimiter, cache_dir), **view)
+    k = data.find(arrow.get(start, date_format).int_timestamp)
+    if k is None:
+        return np.empty(0, dtype=np.int64), {attr: np.empty(0) for attr in attrs or data.attrs}
+    return data.horizon(k, n, attrs)
+
+
+def _load(path, parse_data):
+    if os.path.isdir(path):
+        return read(path)
+
+    data = parse_data()
+    try:
+        write(path, data)
+    except OSError:
+        return data
+    return read(path)
@@ -1,3 +1,6 @@
+import json
+import time as walltime
+
 import mosaik_api
 import paho.mqtt.client as mqtt
 
@@ -13,26 +16,67 @@ META = {
 
 
 class MqttReceiver(mosaik_api.Simulator):
+    """Provide the latest values received on an MQTT topic as attributes.
+
+    The MQTT network loop runs in a background thread. Every message
+    replaces the cached value of the attributes it carries, so a step only
+    reads the cache. A message is one of
+
+    * the text ``attr_name:attr_value``,
+    * a JSON object or msgpack map ``{"attr": value, ...}``; lists of
+      values (columnar batches) and ``{"<time>": value}`` series provide
+      their last value, a ``time`` key is ignored.
+
+    Messages that cannot be decoded are reported and skipped.
+
+    *payload_format* is ``'auto'`` (detect), ``'text'``, ``'json'`` or
+    ``'msgpack'`` (needs the ``msgpack`` package).
+
+    A value older than *max_age* seconds (wall clock) is stale. The
+    *stale* policy then decides what ``get_data`` returns: ``'keep'`` the
+    old value, ``'default'`` the value *default*, or ``'error'`` raises a
+    RuntimeError.
+    """
+
     def __init__(self):
         super().__init__(META)
         self.time_resolution = None
         self.eid = None
         self.mqtt_client = mqtt.Client()
         self.attrs = []
+        # attr -> (value, wall-clock time received); only replaced as a whole
         self.data_cache = {}
         self.modelname = None
-
-    def init(self, sid, mqtt_broker='localhost', mqtt_port=1883, mqtt_topic='mosaik/data', time_resolution=60, attrs):
+        self.payload_format = None
+        self.max_age = None
+        self.stale = None
+        self.default = None
+        self.unpack = None
+
+    def init(self, sid, mqtt_broker='localhost', mqtt_port=1883, mqtt_topic='mosaik/data', time_resolution=60,
+             attrs=None, payload_format='auto', max_age=None, stale='keep', default=None):
+        if payload_format not in ('auto', 'text', 'json', 'msgpack'):
+            raise ValueError('Unknown payload format "%s".' % payload_format)
+        if stale not in ('keep', 'default', 'error'):
+            raise ValueError('Unknown staleness policy "%s".' % stale)
         self.time_resolution = time_resolution
         self.mqtt_broker = mqtt_broker
         self.mqtt_port = mqtt_port
         self.mqtt_topic = mqtt_topic
         self.modelname = mqtt_topic.split('/')[-1]
+        self.payload_format = payload_format
+        self.max_age = max_age
+        self.stale = stale
+        self.default = default
+        if payload_format in ('auto', 'msgpack'):
+            try:
+                import msgpack
+                self.unpack = msgpack.unpackb
+            except ImportError:
+                if payload_format == 'msgpack':
+                    raise
 
-        self.mqtt_client.connect(self.mqtt_broker, self.mqtt_port)
-        self.mqtt_client.on_message = self.on_message
-        self.mqtt_client.subscribe(self.mqtt_topic)
-
+        attrs = list(attrs or [])
         for i, attr in enumerate(attrs):
             try:
                 # Try stripping comments
@@ -42,6 +86,10 @@ class MqttReceiver(mosaik_api.Simulator):
             attrs[i] = attr.strip()
         self.attrs = attrs
 
+        self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.on_message = self.on_message
+        self.mqtt_client.connect(self.mqtt_broker, self.mqtt_port)
+        self.mqtt_client.loop_start()
 
         self.meta['models']['MqttReceiver'] = {
             'public': True,
@@ -58,26 +106,83 @@ class MqttReceiver(mosaik_api.Simulator):
         self.eid = 'MqttReceiver'
         return [{'eid': self.eid, 'type': model}]
 
-    def step(self, time, inputs):
-        self.mqtt_client.loop(timeout=1.0)
+    def step(self, time, inputs, max_advance=None):
+        # The messages are received in the background thread
         return time + self.time_resolution
 
     def get_data(self, outputs):
+        now = walltime.monotonic()
         data = {}
         for eid, attrs in outputs.items():
-            data[eid] = {attr: self.data_cache.get(attr, None) for attr in attrs}
+            data[eid] = {}
+            for attr in attrs:
+                value, received = self.data_cache.get(attr, (None, None))
+                if (self.max_age is not None and self.stale != 'keep'
+                        and (received is None or now - received > self.max_age)):
+                    if self.stale == 'error':
+                        raise RuntimeError('No value for "%s" received in the last %s s.' %
+                                           (attr, self.max_age))
+                    value = self.default
+                data[eid][attr] = value
         return data
 
-    def on_message(self, client, userdata, message):
-        data = message.payload.decode('utf-8')
-        attr_name, attr_value = data.split(':')  # Assuming the message format is "attr_name:attr_value"
+    def on_connect(self, client, userdata, flags, rc):
+        # (Re)subscribe on every connect, so a reconnect keeps the subscription
+        client.subscribe(self.mqtt_topic)
 
-        if attr_name not in self.attrs:
-            self.attrs.append(attr_name)
-
-        self.data_cache[attr_name] = float(attr_value)
+    def on_message(self, client, userdata, message):
+        received = walltime.monotonic()
+        try:
+            values = self.decode(message.payload)
+        except Exception as e:
+            # An exception here would stop the network loop, and with it the
+            # receiver, so a bad message is only reported
+            print('MqttReceiver: skipped a message on "%s" that cannot be decoded: %r' %
+                  (message.topic, e))
+            return
+        for attr, value in values.items():
+            self.data_cache[attr] = (value, received)
+
+    def decode(self, payload):
+        """Return the ``{attr: value}`` carried by the message *payload*."""
+        fmt = self.payload_format
+        if fmt == 'auto':
+            first = payload[:1]
+            if first in (b'{', b'['):
+                fmt = 'json'
+            elif first and (0x80 <= first[0] <= 0x8f or first[0] in (0xde, 0xdf)):
+                fmt = 'msgpack'
+            else:
+                fmt = 'text'
+
+        if fmt == 'text':
+            # The message format is "attr_name:attr_value"
+            text = payload.decode('utf-8')
+            if ':' not in text:
+                raise ValueError('Expected "attr_name:attr_value", got %r.' % text[:80])
+            attr_name, attr_value = text.split(':', 1)
+            return {attr_name.strip(): float(attr_value)}
+
+        if fmt == 'json':
+            values = json.loads(payload)
+        else:
+            values = self.unpack(payload)
+        if not isinstance(values, dict):
+            raise ValueError('Expected an object of attributes, got %s.' % type(values).__name__)
+        data = {}
+        for attr, value in values.items():
+            if attr == 'time':
+                continue
+            if isinstance(value, dict):
+                # A series {time: value}
+                value = value[max(value, key=float)] if value else None
+            elif isinstance(value, list):
+                value = next((v for v in reversed(value) if v is not None), None)
+            data[attr] = value
+        return data
 
     def finalize(self):
+        self.mqtt_client.loop_stop()
         self.mqtt_client.disconnect()
 
 
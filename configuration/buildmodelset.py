@@ -39,10 +39,14 @@ fuelcell_set={'eff':0.45, 'term_eff': 0.2,'max_flow':100, 'min_flow':0,'resoluti
 electrolyser_set={'eff':0.60,'resolution':resolution, 'term_eff': 0.2,'rated_power':2.3,'ramp_rate':1.5}
 # term_eff:  percentage of power transformed in effective heat
 
-RESULTS_SHOW_TYPE={'write2csv':True, 'dashboard_show':False, 'Finalresults_show':True,'database':False,'mqtt':False}
+RESULTS_SHOW_TYPE={'write2csv':True, 'write2parquet':False, 'dashboard_show':False, 'Finalresults_show':True,'database':False,'mqtt':False}
 #'write2csv':True/Flause   Write the results to csv file
+# 'write2parquet':True/False  Write the results to a compressed Parquet file next to the csv file (needs pyarrow)
 # #'Realtime_show':True/Flause, show the results in dashboard
 # 'Finalresults_show':True/Flause, show the results after finish the simulation
+# 'record': optional list of recording rules; only matching values are recorded, e.g.
+#   [{'entity': 'Battery-*', 'attr': 'soc', 'every': 3600, 'to': ['csv']}, {'attr': 'flag', 'to': ['database']}]
+#   entity/attr: patterns, every: seconds between recorded values, to: outputs (default all)
 
 enetwork_set={'max_congestion': 1000, 'p_loss_m': 0.56, 'length': 300}
 
@@ -0,0 +1,146 @@
+"""
+Compact the results of a finished run for analysis.
+
+Reads the results written by the ``Collector`` (``.csv``, ``.parquet`` or
+``.db``) chunk by chunk and writes to the output directory:
+
+* ``results.parquet``: all results as a zstd compressed columnar archive,
+* ``hourly.parquet`` and ``daily.parquet``: rollups in long format, with
+  the columns ``date``, ``entity``, ``attr``, ``sum``, ``mean``, ``min``,
+  ``max`` and ``count`` per hour or day,
+* ``energy.csv``: the energy total of every power series, the integral of
+  its values over time in value x hours (kWh for kW).
+
+The rollups are small and load quickly, e.g.
+``pd.read_parquet('daily.parquet', filters=[('attr', '==', 'soc')])``.
+
+Usage::
+
+    python configuration/compact_results.py Result/ResidentialCase/results.csv --out Result/ResidentialCase/compact
+
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+try:
+    import Models.result_writers as result_writers
+except ModuleNotFoundError:
+    # Run from the configuration folder
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import Models.result_writers as result_writers
+
+
+ENERGY_ATTRS = ['*_gen', '*_dem', '*-p_in', '*-p_out', '*-p_mw', '*-fc_gen']
+"""Patterns of the power columns that get an energy total by default."""
+
+STATS = ['sum', 'count', 'min', 'max']
+HOUR = '60min'  # 'H' is deprecated in newer pandas, 'h' unknown in older
+
+
+def _rollup(partials, freq):
+    # Combine the per-chunk aggregates of a period into one row per period
+    df = pd.concat(partials)
+    df = df.groupby(df.index.floor(freq)).agg({col: col[1] if col[1] != 'count' else 'sum'
+                                              for col in df.columns})
+    df = df.stack(level=0)
+    df['count'] = df['count'].astype(np.int64)
+    df['mean'] = df['sum'] / df['count'].where(df['count'] > 0)
+    df.index.names = ['date', 'name']
+    df = df.reset_index()
+    keys = [result_writers.column_key(name) for name in df['name']]
+    df.insert(1, 'entity', [key[0] for key in keys])
+    df.insert(2, 'attr', [key[1] for key in keys])
+    return df[['date', 'entity', 'attr', 'sum', 'mean', 'min', 'max', 'count']]
+
+
+def compact(path, out_dir, energy=None, dense=False, chunksize=100000, compression='zstd'):
+    """Compact the results in *path* into the directory *out_dir*.
+
+    *energy* are the ``fnmatch`` patterns of the columns that get an energy
+    total (default :data:`ENERGY_ATTRS`). With *dense*, the results were
+    recorded with ``changes_only`` and every value holds until the next
+    one. Returns the energy totals as a DataFrame.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    energy = ENERGY_ATTRS if energy is None else energy
+    archive = result_writers.ParquetWriter(os.path.join(out_dir, 'results.parquet'), compression)
+    hourly = []
+    totals = None
+    last = None
+    step = np.timedelta64(0, 's')
+    try:
+        for chunk in result_writers.iter_results(path, chunksize=chunksize):
+            if not len(chunk):
+                continue
+            archive.write(chunk.index.values.astype('datetime64[s]'),
+                          [result_writers.column_key(name) for name in chunk.columns],
+                          chunk.to_numpy())
+
+            values = chunk.apply(pd.to_numeric, errors='coerce')
+            if last is not None:
+                values = pd.concat([last, values])
+            if dense:
+                values = values.ffill()
+            # Every value holds until the next row; the last row of the chunk
+            # is completed with the next chunk
+            hours = np.diff(values.index.values).astype('timedelta64[s]').astype(np.float64) / 3600
+            power = values[result_writers._select(values.columns, energy)]
+            chunk_totals = power.iloc[:-1].mul(hours, axis=0).sum()
+            totals = chunk_totals if totals is None else totals.add(chunk_totals, fill_value=0)
+
+            rows = values.iloc[1:] if last is not None else values
+            hourly.append(rows.groupby(rows.index.floor(HOUR)).agg(STATS))
+            if len(values) > 1:
+                step = values.index.values[-1] - values.index.values[-2]
+            last = values.iloc[-1:]
+    finally:
+        archive.close()
+
+    if last is None:
+        raise ValueError('No results in "%s".' % path)
+    # The last row lasts as long as the step before it
+    if len(last.columns):
+        power = last[result_writers._select(last.columns, energy)]
+        end = power.iloc[0].fillna(0) * (pd.Timedelta(step).total_seconds() / 3600)
+        totals = end if totals is None else totals.add(end, fill_value=0)
+
+    hourly = _rollup(hourly, HOUR)
+    hourly.to_parquet(os.path.join(out_dir, 'hourly.parquet'), compression=compression, index=False)
+    daily = hourly.assign(date=hourly['date'].dt.floor('D'))
+    daily = daily.groupby(['date', 'entity', 'attr'], sort=True).agg(
+        sum=('sum', 'sum'), min=('min', 'min'), max=('max', 'max'), count=('count', 'sum'))
+    daily['mean'] = daily['sum'] / daily['count'].where(daily['count'] > 0)
+    daily = daily.reset_index()[['date', 'entity', 'attr', 'sum', 'mean', 'min', 'max', 'count']]
+    daily.to_parquet(os.path.join(out_dir, 'daily.parquet'), compression=compression, index=False)
+
+    keys = [result_writers.column_key(name) for name in totals.index]
+    totals = pd.DataFrame({'entity': [key[0] for key in keys], 'attr': [key[1] for key in keys],
+                           'energy': totals.to_numpy()})
+    totals.to_csv(os.path.join(out_dir, 'energy.csv'), index=False)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compact the results of a finished run.')
+    parser.add_argument('results', help='results file (.csv, .parquet or .db)')
+    parser.add_argument('--out', help='output directory (default: <results>_compact)')
+    parser.add_argument('--energy', nargs='*', default=None,
+                        help='column patterns that get an energy total (default: %s)' %
+                             ' '.join(ENERGY_ATTRS))
+    parser.add_argument('--dense', action='store_true',
+                        help='the results were recorded with changes_only')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    out_dir = args.out or os.path.splitext(args.results)[0] + '_compact'
+    totals = compact(args.results, out_dir, args.energy, args.dense, args.chunksize)
+    print('Compacted "%s" into "%s"' % (args.results, out_dir))
+    print(totals.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Compress scenario datafiles for streaming.
+
+Every file is compressed in independent blocks of rows (see
+:func:`Models.scenario_cache.compress_datafile`), so the ``CSVB`` simulator
+can start reading at the start date without decompressing the whole file.
+
+Usage::
+
+    python configuration/compress_scenarios.py Scenarios/load_data.txt --format xz
+
+"""
+import argparse
+import os
+import sys
+
+try:
+    import Models.scenario_cache as scenario_cache
+except ModuleNotFoundError:
+    # Run from the configuration folder
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import Models.scenario_cache as scenario_cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compress scenario datafiles in blocks.')
+    parser.add_argument('datafiles', nargs='+')
+    parser.add_argument('--format', default='gz', choices=['gz', 'bz2', 'xz', 'zst'])
+    parser.add_argument('--block-rows', type=int, default=4096,
+                        help='data rows per compressed block')
+    parser.add_argument('--level', type=int, default=None, help='compression level')
+    args = parser.parse_args(argv)
+
+    for datafile in args.datafiles:
+        dst = scenario_cache.compress_datafile(datafile, '%s.%s' % (datafile, args.format),
+                                               args.block_rows, args.level)
+        print('%s -> %s (%d%%)' % (datafile, dst,
+                                   100 * os.path.getsize(dst) / os.path.getsize(datafile)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""
+Compare the results of two runs, e.g. of a model change against a reference run.
+
+Both runs are aligned on (time, entity, attribute) and compared chunk by
+chunk, so full-year runs with many entities do not have to fit in memory.
+A value differs when it is not within ``atol + rtol * |reference|`` of the
+reference value (numbers) or not equal to it (text); a value present in only
+one run differs too. For every differing series the first differing time,
+the number of differing and compared steps, and the largest absolute
+difference are reported.
+
+Supported results are
+
+* the results of the ``Collector`` (``.csv``, ``.parquet`` or ``.db``),
+* csv files with a time and an entity column per row, like
+  ``RTprice_result.csv`` (``Time,Player,Sell,...``),
+* csv files with a row per entity holding lists of ``[time, value, ...]``,
+  like ``Emarket_results.csv`` and ``Ftrading_results.csv``. The n-th value
+  of an entry is attribute ``<column>.<n>``, single values (totals) are
+  reported at the time ``NaT``.
+
+Usage::
+
+    python configuration/diff_results.py Cases/DBalassi_thesis/1C/RTprice_result.csv Result/RTprice_result.csv
+
+The exit status is 1 when the runs differ.
+"""
+import argparse
+import ast
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+try:
+    import Models.result_writers as result_writers
+except ModuleNotFoundError:
+    # Run from the configuration folder
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import Models.result_writers as result_writers
+
+
+TIME_COLUMNS = ['date', 'Time', 'time', 'Date']
+ENTITY_COLUMNS = ['Player', 'Player_id', 'entity', 'eid']
+
+
+def _iter_rows(path, time_col, entity_col, columns, chunksize):
+    # One row per time and entity: pivot every chunk to a column per
+    # (entity, attribute). The rows of the last time in a chunk may go on in
+    # the next chunk, so they are held back until then.
+    held = None
+    for chunk in pd.read_csv(path, parse_dates=[time_col], chunksize=chunksize):
+        if held is not None:
+            chunk = pd.concat([held, chunk])
+        last = chunk[time_col].iloc[-1]
+        held = chunk[chunk[time_col] == last]
+        chunk = chunk[chunk[time_col] != last]
+        if len(chunk):
+            yield _pivot(chunk, time_col, entity_col, columns)
+    if held is not None and len(held):
+        yield _pivot(held, time_col, entity_col, columns)
+
+
+def _pivot(chunk, time_col, entity_col, columns):
+    chunk = chunk.drop_duplicates([time_col, entity_col], keep='last')
+    wide = chunk.set_index([time_col, entity_col]).unstack(entity_col)
+    wide.columns = [result_writers.column_name((entity, attr)) for attr, entity in wide.columns]
+    wide = wide[_select(wide.columns, columns)]
+    return wide.sort_index(axis=1).rename_axis(None)
+
+
+def _read_nested(path, entity_col, columns):
+    # One row per entity holding lists of [time, value, ...] entries
+    series = {}
+    for _, row in pd.read_csv(path, dtype=str, keep_default_na=False).iterrows():
+        entity = row[entity_col]
+        for col, cell in row.items():
+            if col == entity_col:
+                continue
+            try:
+                value = ast.literal_eval(cell)
+            except (ValueError, SyntaxError):
+                value = cell
+            if not isinstance(value, list):
+                series[(entity, col)] = pd.Series([value], index=pd.DatetimeIndex([pd.NaT]))
+                continue
+            entries = pd.DataFrame([entry[1:] for entry in value],
+                                   index=pd.to_datetime([entry[0] for entry in value]))
+            # Several entries at one time are told apart by their position
+            position = entries.groupby(level=0).cumcount()
+            for n in entries.columns:
+                for k in np.unique(position):
+                    attr = '%s.%d' % (col, n + 1) + ('#%d' % (k + 1) if k else '')
+                    series[(entity, attr)] = entries.loc[position.to_numpy() == k, n]
+    frame = pd.DataFrame({result_writers.column_name(key): values for key, values in series.items()})
+    frame = frame[_select(frame.columns, columns)]
+    yield frame.sort_index().sort_index(axis=1)
+
+
+def _select(names, columns):
+    return result_writers._select(list(names), columns) if columns else list(names)
+
+
+def iter_run(path, columns=None, chunksize=100000):
+    """Yield the results in *path* as DataFrames with a column per
+    ``entity-attr`` and the time as index, in time order."""
+    if os.path.splitext(path)[1] in ('.parquet', '.db'):
+        return result_writers.iter_results(path, columns, chunksize)
+    header = list(pd.read_csv(path, nrows=0).columns)
+    entity_col = next((col for col in ENTITY_COLUMNS if col in header), None)
+    time_col = next((col for col in TIME_COLUMNS if col in header), None)
+    if header[0] == 'date' and entity_col is None:
+        return result_writers.iter_results(path, columns, chunksize)
+    if entity_col is None:
+        raise ValueError('Unknown results format of "%s".' % path)
+    if time_col is None:
+        return _read_nested(path, entity_col, columns)
+    return _iter_rows(path, time_col, entity_col, columns, chunksize)
+
+
+def _aligned(a, b):
+    # Yield the rows of both runs up to the last time both have read, so
+    # every time is compared once and with all its values
+    runs = [[iter(a), None, False], [iter(b), None, False]]  # chunks, buffer, done
+    while True:
+        for run in runs:
+            while not run[2] and (run[1] is None or not len(run[1])):
+                chunk = next(run[0], None)
+                if chunk is None:
+                    run[2] = True
+                else:
+                    run[1] = chunk.sort_index()
+        if all(run[1] is None or not len(run[1]) for run in runs):
+            return
+        ends = [run[1].index.max() for run in runs if not run[2]]
+        ends = [end for end in ends if pd.notna(end)]
+        parts = []
+        for run in runs:
+            buf = run[1]
+            if buf is None:
+                parts.append(None)
+                continue
+            if ends:
+                # NaT (totals) is taken right away
+                take = (buf.index <= min(ends)) | buf.index.isna()
+            else:
+                take = np.ones(len(buf), bool)
+            parts.append(buf[take])
+            run[1] = buf[~take]
+        yield parts
+
+
+class _Series:
+    __slots__ = ('first', 'diverging', 'steps', 'max_diff')
+
+    def __init__(self):
+        self.first = None
+        self.diverging = 0
+        self.steps = 0
+        self.max_diff = 0.
+
+
+def diff_runs(reference, result, rtol=1e-9, atol=1e-9, columns=None, chunksize=100000):
+    """Compare the run *result* to the run *reference*.
+
+    Returns a DataFrame with a row per differing series: ``entity``,
+    ``attr``, ``first_divergence`` (the first time the values differ),
+    ``diverging_steps``, ``steps`` and ``max_abs_diff``. A series in only
+    one run has ``only_in`` set to ``'reference'`` or ``'result'``.
+    """
+    stats = {}
+    seen = {'reference': set(), 'result': set()}
+    for part_a, part_b in _aligned(iter_run(reference, columns, chunksize),
+                                   iter_run(result, columns, chunksize)):
+        if part_a is not None:
+            seen['reference'].update(part_a.columns)
+        if part_b is not None:
+            seen['result'].update(part_b.columns)
+        if part_a is None or part_b is None:
+            continue
+        names = part_a.columns.intersection(part_b.columns)
+        index = part_a.index.union(part_b.index)
+        if not len(names) or not len(index):
+            continue
+        a = part_a[names].reindex(index)
+        b = part_b[names].reindex(index)
+        va = a.apply(pd.to_numeric, errors='coerce').to_numpy(np.float64)
+        vb = b.apply(pd.to_numeric, errors='coerce').to_numpy(np.float64)
+        close = np.isclose(vb, va, rtol=rtol, atol=atol, equal_nan=True)
+        # Text is compared as is
+        text = (np.isnan(va) & a.notna().to_numpy()) | (np.isnan(vb) & b.notna().to_numpy())
+        if text.any():
+            close[text] = (a.to_numpy(object) == b.to_numpy(object))[text]
+        present = a.notna().to_numpy() | b.notna().to_numpy()
+        diff = np.abs(vb - va)
+        diff[~np.isfinite(diff)] = 0
+
+        steps = present.sum(axis=0)
+        bad = ~close
+        diverging = bad.sum(axis=0)
+        first = bad.argmax(axis=0)
+        max_diff = np.where(bad, diff, 0).max(axis=0)
+        for i, name in enumerate(names):
+            series = stats.get(name)
+            if series is None:
+                series = stats[name] = _Series()
+            series.steps += int(steps[i])
+            if diverging[i]:
+                if series.first is None:
+                    series.first = index[first[i]]
+                series.diverging += int(diverging[i])
+                series.max_diff = max(series.max_diff, float(max_diff[i]))
+
+    rows = []
+    for name, series in stats.items():
+        if series.diverging:
+            rows.append(result_writers.column_key(name) + (series.first, series.diverging,
+                                                           series.steps, series.max_diff, None))
+    for run, other in (('reference', 'result'), ('result', 'reference')):
+        for name in seen[run] - seen[other]:
+            rows.append(result_writers.column_key(name) + (None, None, None, None, run))
+    report = pd.DataFrame(rows, columns=['entity', 'attr', 'first_divergence', 'diverging_steps',
+                                         'steps', 'max_abs_diff', 'only_in'])
+    return report.sort_values(['first_divergence', 'entity', 'attr'],
+                              na_position='last').reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the results of two runs.')
+    parser.add_argument('reference', help='results of the reference run')
+    parser.add_argument('result', help='results to compare to the reference')
+    parser.add_argument('--rtol', type=float, default=1e-9, help='relative tolerance')
+    parser.add_argument('--atol', type=float, default=1e-9, help='absolute tolerance')
+    parser.add_argument('--columns', nargs='*', default=None,
+                        help='only compare these entity-attr columns (fnmatch patterns)')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--out', help='also write the report to this csv file')
+    args = parser.parse_args(argv)
+
+    report = diff_runs(args.reference, args.result, args.rtol, args.atol, args.columns,
+                       args.chunksize)
+    if args.out:
+        report.to_csv(args.out, index=False)
+    if not len(report):
+        print('No differences')
+        return 0
+    print('%d series differ:' % len(report))
+    print(report.to_string(index=False))
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
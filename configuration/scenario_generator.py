@@ -0,0 +1,140 @@
+"""
+Generate random-walk scenario datafiles for the ``Scenarios`` folder.
+
+Every attribute is a random walk that starts at a uniform random value in
+``[min_val, max_val]``, moves by a uniform random step in
+``[-max_var, max_var]`` every time step and is clipped to
+``[min_val, max_val]``. The walks are computed with NumPy for all
+attributes (and households) at once, from a fixed seed, and can be written
+as text datafiles and directly in the binary format of
+:mod:`Models.scenario_cache`.
+
+Example::
+
+    data = generate(['load'], {'load': 0}, {'load': 400}, {'load': 50},
+                    '2012-01-01 00:00:00', '2012-12-31 23:45:00', seed=1)
+    write(data, '../Scenarios/load_data.txt')
+
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import Models.scenario_cache as scenario_cache
+except ModuleNotFoundError:
+    # Run from the configuration folder
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import Models.scenario_cache as scenario_cache
+
+
+def clipped_walk(start, steps, lo, hi, chunk=96):
+    """Return the clipped random walk that starts at *start* and moves by
+    *steps*.
+
+    *steps* is an ``(n, k)`` array for *k* walks (its first row is not
+    used), *start*, *lo* and *hi* have one entry per walk. Row ``t`` of the
+    result is ``clip(walk[t - 1] + steps[t], lo, hi)``.
+
+    The walk is built from cumulative sums over chunks of *chunk* steps.
+    Only chunks in which a walk hits its bounds are stepped one by one.
+    """
+    n, k = steps.shape
+    out = np.empty((n, k))
+    x = np.clip(np.asarray(start, dtype=np.float64), lo, hi)
+    out[0] = x
+    t = 1
+    while t < n:
+        stop = min(t + chunk, n)
+        seg = x + np.cumsum(steps[t:stop], axis=0)
+        if ((seg >= lo) & (seg <= hi)).all():
+            out[t:stop] = seg
+        else:
+            for i in range(t, stop):
+                x = np.clip(x + steps[i], lo, hi)
+                out[i] = x
+        x = out[stop - 1]
+        t = stop
+    return out
+
+
+def generate(attrs, min_vals, max_vals, max_vars, start, end, step=900, seed=None,
+             modelname=None, households=1):
+    """Generate a :class:`scenario_cache.ScenarioData` of random walks.
+
+    *attrs* are the attribute names; *min_vals*, *max_vals* and *max_vars*
+    map each attribute to its range and maximum step. The series runs from
+    *start* to *end* (date strings, both included) every *step* seconds.
+
+    With *households* > 1, every attribute gets that many independent
+    walks, named ``<attr>_<i>``.
+    """
+    rng = np.random.default_rng(seed)
+    times = np.arange(np.datetime64(pd.Timestamp(start), 's'),
+                      np.datetime64(pd.Timestamp(end), 's') + 1,
+                      np.timedelta64(step, 's')).astype(np.int64)
+
+    lo = np.repeat([float(min_vals[attr]) for attr in attrs], households)
+    hi = np.repeat([float(max_vals[attr]) for attr in attrs], households)
+    var = np.repeat([float(max_vars[attr]) for attr in attrs], households)
+    steps = rng.uniform(-var, var, size=(len(times), len(var)))
+    values = clipped_walk(rng.uniform(lo, hi), steps, lo, hi)
+
+    if households > 1:
+        attrs = ['%s_%s' % (attr, i) for attr in attrs for i in range(households)]
+    return scenario_cache.ScenarioData(modelname or '', attrs, times, values)
+
+
+def write(data, file_name, text=True, binary=True, cache_dir=None):
+    """Write *data* as the scenario datafile *file_name*.
+
+    The model name defaults to the capitalized file name, like
+    ``eboiler_data.txt`` -> ``Eboiler_data``. With *binary*, the data is
+    also stored in the scenario cache, so the first simulation run does not
+    parse the text file. Binary output requires the text file, because the
+    cache entry is keyed by its content.
+    """
+    if binary and not text:
+        raise ValueError('The binary output of "%s" needs the text file as well, '
+                         'because the scenario cache is keyed by its content.' % file_name)
+    if not data.modelname:
+        data.modelname = os.path.basename(file_name).split('.')[0].capitalize()
+    if text:
+        dates = np.datetime_as_string(np.asarray(data.times).astype('datetime64[s]'))
+        df = pd.DataFrame(np.asarray(data.values), columns=data.attrs,
+                          index=np.char.replace(dates, 'T', ' '))
+        with open(file_name, 'w', newline='') as f:
+            f.write(data.modelname + '\n')
+            f.write('time,' + ','.join(data.attrs) + '\n')
+            df.to_csv(f, header=False)
+    if binary:
+        key = scenario_cache.file_key(file_name, scenario_cache.DEFAULT_DATE_FORMAT, ',')
+        path = scenario_cache.entry_path(file_name, key, cache_dir)
+        if not os.path.isdir(path):
+            scenario_cache.write(path, data)
+    return file_name
+
+
+def _generate_file(spec):
+    spec = dict(spec)
+    file_name = spec.pop('file_name')
+    text = spec.pop('text', True)
+    binary = spec.pop('binary', True)
+    return write(generate(**spec), file_name, text, binary)
+
+
+def generate_files(specs, seed=None, workers=None):
+    """Generate and write many datafiles in parallel processes.
+
+    Every entry of *specs* is a dict with the arguments of :func:`generate`
+    plus ``'file_name'`` (and optionally ``'text'`` and ``'binary'``). Each
+    file gets its own random stream derived from *seed*, so the result does
+    not depend on *workers* or on the order the files finish in.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(specs))
+    specs = [dict(spec, seed=spec.get('seed', s)) for spec, s in zip(specs, seeds)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_generate_file, specs))
@@ -42,7 +42,7 @@ WIND_on_DATA = 'Scenarios/winddata_NL.txt'  # same wind but different turbines
 WIND_off_DATA = 'Scenarios/winddata_NL.txt'
 Pv_DATA = 'Scenarios/pv_data_Rotterdam_NL-15min.txt'
 load_DATA = 'Scenarios/load_data.txt'
-battery_DATA = 'Scenarios/battery_data.txt'
+battery_DATA = 'Scenarios/Battery_data.txt'
 electrolyser_DATA = 'Scenarios/electrolyser_data.txt'
 h2storage_DATA = 'Scenarios/h2storage_data.txt'
 ttrailers_DATA = 'Scenarios/ttrailers_data.txt'
@@ -126,9 +126,17 @@ Defined_models['number'] = number
 collector = world.start('Collector', start_date=START_DATE, results_show=RESULTS_SHOW_TYPE,output_file=outputfile)
 monitor = collector.Monitor()
 
+# A single CSVB process serves the scenario data of all models
+scenariodata = world.start('CSVB', sim_start=START_DATE,
+                           datafile=[WIND_on_DATA, WIND_off_DATA, Pv_DATA, load_DATA, battery_DATA,
+                                     electrolyser_DATA, h2storage_DATA, ttrailers_DATA, fuelcell_DATA,
+                                     h2product_DATA, h2demand_r_DATA, h2demand_fs_DATA, h2demand_ev_DATA,
+                                     qstorage_DATA, qstorage_s_DATA, qstorage_d_DATA, qproduct_DATA,
+                                     qdemand_i_DATA, qdemand_r_DATA, hp_DATA, eboiler_DATA])
+
 for model_i in Defined_models.iterrows():
     if model_i[1]['model'] == 'PV':
-        solardata = world.start('CSVB', sim_start=START_DATE, datafile=Pv_DATA)
+        solardata = scenariodata
         pvsim = world.start('PV')
         pv = pvsim.PVset.create(model_i[1]['number'], sim_start=START_DATE, panel_data=pv_panel_set,
                                 m_tilt=pv_set['m_tilt'], m_az=pv_set['m_az'], cap=pv_set['cap'],
@@ -138,7 +146,7 @@ for model_i in Defined_models.iterrows():
             world.connect(solarprofile_data[i], pv[i], 'G_Gh', 'G_Dh', 'G_Bn', 'Ta', 'hs', 'FF', 'Az')
 
     elif model_i[1]['model'] == 'Wind_on':
-        WSdata = world.start('CSVB', sim_start=START_DATE, datafile=WIND_on_DATA)
+        WSdata = scenariodata
         wind_on_sim = world.start('Wind')
         wind_on = wind_on_sim.windmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                p_rated=Wind_on_set['p_rated'], u_rated=Wind_on_set['u_rated'],
@@ -150,7 +158,7 @@ for model_i in Defined_models.iterrows():
             world.connect(windspeed_on_data[i], wind_on[i], 'u')
 
     elif model_i[1]['model'] == 'Wind_off':
-        WSdata = world.start('CSVB', sim_start=START_DATE, datafile=WIND_off_DATA)
+        WSdata = scenariodata
         wind_off_sim = world.start('Wind')
         wind_off = wind_off_sim.windmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                  p_rated=Wind_off_set['p_rated'], u_rated=Wind_off_set['u_rated'],
@@ -162,7 +170,7 @@ for model_i in Defined_models.iterrows():
             world.connect(windspeed_off_data[i], wind_off[i], 'u')
 
     elif model_i[1]['model'] == 'Load':
-        loaddata = world.start('CSVB', sim_start=START_DATE, datafile=load_DATA)
+        loaddata = scenariodata
         loadsim = world.start('Load')
         load = loadsim.loadmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                         houses=load_set['houses'], output_type=load_set['output_type'])
@@ -178,7 +186,7 @@ for model_i in Defined_models.iterrows():
                                                      length=enetwork_set['length'])
 
     elif model_i[1]['model'] == 'Battery' and model_i[1]['number'] != 0:
-        batterydata = world.start('CSVB', sim_start=START_DATE, datafile=battery_DATA)
+        batterydata = scenariodata
         batterysim = world.start('Battery')
         battery = batterysim.Batteryset.create(model_i[1]['number'], sim_start=START_DATE,
                                                initial_set=Battery_initialset, battery_set=Battery_set)
@@ -187,7 +195,7 @@ for model_i in Defined_models.iterrows():
             world.connect(battery_data[i], battery[i], 'flow2b')
 
     elif model_i[1]['model'] == 'Electrolyser':
-        electrodata = world.start('CSVB', sim_start=START_DATE, datafile=electrolyser_DATA)
+        electrodata = scenariodata
         electrosim = world.start('Electrolyser')
         electrolyser = electrosim.electrolysermodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                            eff=electrolyser_set['eff'],
@@ -200,7 +208,7 @@ for model_i in Defined_models.iterrows():
             world.connect(electrolyser_data[i], electrolyser[i], 'flow2e')
 
     elif model_i[1]['model'] == 'Fuelcell':
-        fuelcelldata = world.start('CSVB', sim_start=START_DATE, datafile=fuelcell_DATA)
+        fuelcelldata = scenariodata
         fcsim = world.start('Fuelcell')
         fuelcell = fcsim.fuelcellmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                               eff=fuelcell_set['eff'], resolution=fuelcell_set['resolution'],
@@ -212,7 +220,7 @@ for model_i in Defined_models.iterrows():
             world.connect(fuelcell_data[i], fuelcell[i], 'h2_consume')
 
     elif model_i[1]['model'] == 'H2Storage':
-        h2storagedata = world.start('CSVB', sim_start=START_DATE, datafile=h2storage_DATA)
+        h2storagedata = scenariodata
         h2storagesim = world.start('H2storage')
         h2storage = h2storagesim.compressed_hydrogen.create(model_i[1]['number'], sim_start=START_DATE,
                                                             initial_set=h2storage_initial, h2_set=h2_set)
@@ -221,7 +229,7 @@ for model_i in Defined_models.iterrows():
             world.connect(h2storage_data[i], h2storage[i], 'flow2h2s')
 
     elif model_i[1]['model'] == 'Ttrailers':
-        ttrailersdata = world.start('CSVB', sim_start=START_DATE, datafile=ttrailers_DATA)
+        ttrailersdata = scenariodata
         ttrailerssim = world.start('H2storage')
         ttrailers = ttrailerssim.compressed_hydrogen.create(model_i[1]['number'], sim_start=START_DATE,
                                                             initial_set=ttrailers_initial, h2_set=h2_set)
@@ -241,7 +249,7 @@ for model_i in Defined_models.iterrows():
                                              leakage=h2network_set['leakage'])
 
     elif model_i[1]['model'] == 'H2demand_r':
-        h2demand_rdata = world.start('CSVB', sim_start=START_DATE, datafile=h2demand_r_DATA)
+        h2demand_rdata = scenariodata
         h2demand_rsim = world.start('H2demand')
         h2demand_r = h2demand_rsim.h2demandmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                         houses=h2demand_r_set['houses'])
@@ -250,7 +258,7 @@ for model_i in Defined_models.iterrows():
             world.connect(h2demand_r_data[i], h2demand_r[i], 'h2demand')
 
     elif model_i[1]['model'] == 'H2demand_fs':
-        h2demand_fsdata = world.start('CSVB', sim_start=START_DATE, datafile=h2demand_fs_DATA)
+        h2demand_fsdata = scenariodata
         h2demand_fssim = world.start('H2demand')
         h2demand_fs = h2demand_fssim.h2demandmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                           houses=h2demand_fs_set['tanks'])
@@ -259,7 +267,7 @@ for model_i in Defined_models.iterrows():
             world.connect(h2demand_fs_data[i], h2demand_fs[i], 'h2demand')
 
     elif model_i[1]['model'] == 'H2demand_ev':
-        h2demand_evdata = world.start('CSVB', sim_start=START_DATE, datafile=h2demand_ev_DATA)
+        h2demand_evdata = scenariodata
         h2demand_evsim = world.start('H2demand')
         h2demand_ev = h2demand_evsim.h2demandmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                           houses=h2demand_ev_set['cars'])
@@ -268,7 +276,7 @@ for model_i in Defined_models.iterrows():
             world.connect(h2demand_ev_data[i], h2demand_ev[i], 'h2demand')
 
     elif model_i[1]['model'] == 'H2product':
-        h2productdata = world.start('CSVB', sim_start=START_DATE, datafile=h2product_DATA)
+        h2productdata = scenariodata
         h2productsim = world.start('H2product')
         h2product = h2productsim.h2productmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                        houses=h2product_set['houses'])
@@ -289,7 +297,7 @@ for model_i in Defined_models.iterrows():
                                               c=heatnetwork_set['c'])
 
     elif model_i[1]['model'] == 'Heatstorage':
-        heatstoragedata = world.start('CSVB', sim_start=START_DATE, datafile=qstorage_DATA)
+        heatstoragedata = scenariodata
         heatstoragesim = world.start('HeatStorage')
         heatstorage = heatstoragesim.HeatStorage.create(model_i[1]['number'], sim_start=START_DATE,
                                                   soc_init=heatstorage_set['soc_init'],
@@ -309,7 +317,7 @@ for model_i in Defined_models.iterrows():
             world.connect(heatstorage_data[i], heatstorage[i], 'flow2qs')
 
     elif model_i[1]['model'] == 'Heatstorage_s':
-        heatstorage_sdata = world.start('CSVB', sim_start=START_DATE, datafile=qstorage_s_DATA)
+        heatstorage_sdata = scenariodata
         heatstorage_ssim = world.start('HeatStorage')
         heatstorage_s = heatstorage_ssim.HeatStorage.create(model_i[1]['number'], sim_start=START_DATE,
                                                          soc_init=heatstorage_s_set['soc_init'],
@@ -331,7 +339,7 @@ for model_i in Defined_models.iterrows():
 
 
     elif model_i[1]['model'] == 'Heatdemand_r':
-        heatdemand_rdata = world.start('CSVB', sim_start=START_DATE, datafile=qdemand_r_DATA)
+        heatdemand_rdata = scenariodata
         heatdemand_rsim = world.start('Heatdemand')
         heatdemand_r = heatdemand_rsim.qdemandmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                            utilities=heatdemand_r_set['houses'])
@@ -340,7 +348,7 @@ for model_i in Defined_models.iterrows():
             world.connect(heatdemand_r_data[i], heatdemand_r[i], 'qdemand')
 
     elif model_i[1]['model'] == 'Heatdemand_i':
-        heatdemand_idata = world.start('CSVB', sim_start=START_DATE, datafile=qdemand_i_DATA)
+        heatdemand_idata = scenariodata
         heatdemand_isim = world.start('Heatdemand')
         heatdemand_i = heatdemand_isim.qdemandmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                            utilities=heatdemand_i_set['factories'])
@@ -349,7 +357,7 @@ for model_i in Defined_models.iterrows():
             world.connect(heatdemand_i_data[i], heatdemand_i[i], 'qdemand')
 
     elif model_i[1]['model'] == 'Heatproduct':
-        heatproductdata = world.start('CSVB', sim_start=START_DATE, datafile=qproduct_DATA)
+        heatproductdata = scenariodata
         heatproductsim = world.start('Heatproduct')
         heatproduct = heatproductsim.qproductmodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                     utilities=heatproduct_set['utilities'])
@@ -358,7 +366,7 @@ for model_i in Defined_models.iterrows():
             world.connect(heatproduct_data[i], heatproduct[i], 'qproduct')
 
     elif model_i[1]['model'] == 'Heatstorage_d':
-        heatstorage_ddata = world.start('CSVB', sim_start=START_DATE, datafile=qstorage_d_DATA)
+        heatstorage_ddata = scenariodata
         heatstorage_dsim = world.start('HeatStorage')
         heatstorage_d = heatstorage_dsim.HeatStorage.create(model_i[1]['number'], sim_start=START_DATE,
                                                       soc_init=heatstorage_d_set['soc_init'],
@@ -378,7 +386,7 @@ for model_i in Defined_models.iterrows():
             world.connect(heatstorage_d_data[i], heatstorage_d[i], 'flow2qs')
 
     elif model_i[1]['model'] == 'Eboiler':
-        eboilerdata = world.start('CSVB', sim_start=START_DATE, datafile=eboiler_DATA)
+        eboilerdata = scenariodata
         eboilersim = world.start('Eboiler')
         eboiler = eboilersim.eboilermodel.create(model_i[1]['number'], sim_start=START_DATE,
                                                  eboiler_set=eboiler_set)
@@ -393,7 +401,7 @@ for model_i in Defined_models.iterrows():
 
     elif model_i[1]['model'] == 'HeatPump':
         heatpumpsim = world.start('HeatPump', step_size=15 * 60)
-        csv = world.start('CSVB', sim_start=START_DATE, datafile=hp_DATA)
+        csv = scenariodata
 
         # Instantiate models
         heatpump = heatpumpsim.HeatPump(params=hp_params)
@@ -0,0 +1,105 @@
+import sqlite3
+
+import numpy as np
+
+from Models.collector import Collector
+import Models.result_writers as result_writers
+
+
+def dates(*times):
+    return np.array(['2012-01-01T%s' % time for time in times], dtype='datetime64[s]')
+
+
+def test_csv_late_columns_are_added(tmp_path):
+    output = tmp_path / 'results.csv'
+    writer = result_writers.CSVWriter(str(output), chunksize=1)
+    writer.write(dates('00:00:00', '00:15:00'), [('A', 'p')], np.array([[1.0], [2.0]]))
+    writer.write(dates('00:30:00'), [('A', 'p'), ('B', 'mode')], np.array([[3.0, 'on']], dtype=object))
+    writer.write(dates('00:45:00'), [('B', 'mode')], np.array([['off']], dtype=object))
+    writer.close()
+
+    assert output.read_text().splitlines() == [
+        'date,A-p,B-mode', '2012-01-01 00:00:00,1.0,', '2012-01-01 00:15:00,2.0,',
+        '2012-01-01 00:30:00,3.0,on', '2012-01-01 00:45:00,,off']
+    df = result_writers.read_results(str(output))
+    assert df['B-mode'].tolist()[2:] == ['on', 'off']
+
+
+def test_parquet_column_without_values_takes_later_text(tmp_path):
+    output = tmp_path / 'results.parquet'
+    writer = result_writers.ParquetWriter(str(output))
+    writer.write(dates('00:00:00'), [('C', 'mode')], np.array([[np.nan]]))
+    writer.write(dates('00:15:00'), [('C', 'mode')], np.array([['charge']], dtype=object))
+    writer.close()
+
+    df = result_writers.read_results(str(output))
+    assert df['C-mode'].isna().tolist() == [True, False]
+    assert df['C-mode'].iloc[1] == 'charge'
+
+
+def test_parquet_schema_changes_after_the_first_row_group(tmp_path):
+    output = tmp_path / 'results.parquet'
+    writer = result_writers.ParquetWriter(str(output), row_group_size=1)
+    writer.write(dates('00:00:00'), [('A', 'p'), ('C', 'mode')],
+                 np.array([[1.0, None]], dtype=object))
+    writer.write(dates('00:15:00'), [('A', 'p')], np.array([[2.0]]))
+    # A late column and text in a number column
+    writer.write(dates('00:30:00'), [('A', 'p'), ('B', 'on'), ('C', 'mode')],
+                 np.array([['high', True, 'idle']], dtype=object))
+    writer.write(dates('00:45:00'), [('A', 'p'), ('B', 'on')],
+                 np.array([[3.5, False]], dtype=object))
+    writer.close()
+
+    df = result_writers.read_results(str(output))
+    assert list(df.columns) == ['A-p', 'C-mode', 'B-on']
+    assert df['A-p'].tolist() == ['1.0', '2.0', 'high', '3.5']
+    assert df['C-mode'].isna().tolist() == [True, True, False, True]
+    assert df['C-mode'].iloc[2] == 'idle'
+    assert df['B-on'].isna().tolist() == [True, True, False, False]
+    assert df['B-on'].iloc[2:].tolist() == [True, False]
+    assert len(df) == 4 and not (tmp_path / 'results.parquet.old').exists()
+
+
+def test_parquet_keeps_types(tmp_path):
+    output = tmp_path / 'results.parquet'
+    writer = result_writers.ParquetWriter(str(output))
+    writer.write(dates('00:00:00', '00:15:00'), [('A', 'p'), ('A', 'n'), ('A', 'on')],
+                 np.array([[1.5, 2, True], [np.nan, 3, False]], dtype=object))
+    writer.close()
+
+    df = result_writers.read_results(str(output))
+    assert [str(dtype) for dtype in df.dtypes] == ['float64', 'int64', 'bool']
+
+
+def test_sqlite_stores_lists_as_json(tmp_path):
+    db = tmp_path / 'results.db'
+    writer = result_writers.SQLiteWriter(str(db))
+    writer.write(dates('00:00:00'), [('A', 'p'), ('A', 'bids'), ('A', 'info'), ('A', 'on')],
+                 np.array([[1.5, [1.0, 2.0], {'a': 1}, True]], dtype=object))
+    writer.close()
+
+    conn = sqlite3.connect(str(db))
+    assert conn.execute('SELECT attr, value FROM results').fetchall() == [
+        ('p', 1.5), ('bids', '[1.0, 2.0]'), ('info', '{"a": 1}'), ('on', 1)]
+    conn.close()
+
+
+def test_aggregated_csv_keeps_ints(tmp_path):
+    output = tmp_path / 'results.csv'
+    collector = Collector()
+    collector.init('Collector-0', 1, '2012-01-01 00:00:00',
+                   {'write2csv': True, 'dashboard_show': False, 'database': False}, str(output),
+                   async_writes=True, aggregate_window=1800,
+                   aggregate_rules={'*-n': 'max', '*-on': 'last', '*': 'mean'})
+    collector.create(1, 'Monitor')
+    # The aggregation runs in the writer thread
+    writer, = collector.writers
+    assert isinstance(writer, result_writers.AsyncWriter)
+    assert isinstance(writer.writers[0], result_writers.Aggregator)
+    steps = [(1.0, 1, True), (2.0, None, False), (3.0, 3, None), (4.0, 4, True)]
+    for i, (p, n, on) in enumerate(steps):
+        collector.step(i * 900, {'Monitor': {'p': {'A': p}, 'n': {'A': n}, 'on': {'A': on}}}, None)
+    collector.finalize()
+
+    assert output.read_text().splitlines() == [
+        'date,A-p,A-n,A-on', '2012-01-01 00:00:00,1.5,1,False', '2012-01-01 00:30:00,3.5,4,True']
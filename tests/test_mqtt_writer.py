@@ -0,0 +1,146 @@
+import json
+
+import numpy as np
+import pytest
+
+from Models.collector import Collector
+import Models.result_writers as result_writers
+
+
+class FakeInfo:
+    def __init__(self):
+        self.waited = False
+
+    def wait_for_publish(self, timeout=None):
+        self.waited = True
+
+
+class FakeClient:
+    """Stand-in for the paho client that records the published messages."""
+
+    def __init__(self):
+        self.messages = []
+        self.infos = []
+        self.running = False
+        self.connected = True
+
+    def publish(self, topic, payload, qos=0):
+        self.messages.append((topic, payload, qos))
+        self.infos.append(FakeInfo())
+        return self.infos[-1]
+
+    def loop_start(self):
+        self.running = True
+
+    def loop_stop(self):
+        self.running = False
+
+    def disconnect(self):
+        self.connected = False
+
+
+RESULTS_SHOW = {'write2csv': False, 'dashboard_show': False, 'database': False, 'mqtt': True}
+
+
+def make_collector(client, **params):
+    collector = Collector()
+    collector.init('Collector-0', 1, '2012-01-01 00:00:00', RESULTS_SHOW, 'unused.csv',
+                   mqtt_client=client, **params)
+    collector.create(1, 'Monitor')
+    return collector
+
+
+def test_collector_publishes_batches_of_steps():
+    client = FakeClient()
+    collector = make_collector(client, mqtt_topic='illuminator', mqtt_qos=1, mqtt_batch_steps=2,
+                               mqtt_encoding='json')
+    assert client.running
+
+    for i, time in enumerate(range(0, 5 * 900, 900)):
+        collector.step(time, {'Monitor': {'p': {'PV-0.pv_0': float(i)}, 'soc': {'Battery-0.b': 50 + i}}},
+                       None)
+        # Sent as soon as a batch is full, not when the file outputs flush
+        assert len(client.messages) == (i + 1) // 2
+    collector.finalize()
+
+    assert [(topic, qos) for topic, _, qos in client.messages] == [('illuminator', 1)] * 3
+    payloads = [json.loads(payload) for _, payload, _ in client.messages]
+    start = int(np.datetime64('2012-01-01T00:00:00', 's').astype(np.int64))
+    assert payloads[0] == {'time': [start, start + 900], 'PV-0.pv_0-p': [0.0, 1.0],
+                           'Battery-0.b-soc': [50, 51]}
+    # The last, partial batch is sent on finalize
+    assert payloads[2] == {'time': [start + 3600], 'PV-0.pv_0-p': [4.0], 'Battery-0.b-soc': [54]}
+    assert client.infos[-1].waited
+    assert not client.running and not client.connected
+
+
+def test_collector_default_sends_every_step():
+    client = FakeClient()
+    collector = make_collector(client, mqtt_topic='t')
+    collector.step(0, {'Monitor': {'p': {'A': 1.5}}}, None)
+    collector.step(900, {'Monitor': {'p': {'A': None}}}, None)
+    collector.finalize()
+
+    assert len(client.messages) == 2
+    topic, payload, qos = client.messages[0]
+    assert (topic, qos) == ('t', 0)
+    # The layout of DataFrame.to_json, missing values are left out
+    assert json.loads(payload) == {'A-p': {'1325376000000': 1.5}}
+    assert json.loads(client.messages[1][1]) == {}
+
+
+def test_per_entity_topics():
+    client = FakeClient()
+    writer = result_writers.MQTTWriter(None, 'base', encoding='json', per_entity=True, client=client)
+    dates = np.array(['2012-01-01T00:00:00'], dtype='datetime64[s]')
+    writer.write(dates, [('A', 'p'), ('B', 'p'), ('A', 'q')], np.array([[1.0, 2.0, np.nan]]))
+    writer.close()
+
+    messages = {topic: json.loads(payload) for topic, payload, _ in client.messages}
+    assert messages == {'base/A': {'time': [1325376000], 'p': [1.0], 'q': [None]},
+                        'base/B': {'time': [1325376000], 'p': [2.0]}}
+
+
+def test_columns_change_within_a_batch():
+    client = FakeClient()
+    writer = result_writers.MQTTWriter(None, 't', batch_steps=3, encoding='json', client=client)
+    dates = np.array(['2012-01-01T00:00:00', '2012-01-01T00:15:00'], dtype='datetime64[s]')
+    writer.write(dates[:1], [('A', 'p')], np.array([[1.0]]))
+    # A new column sends the rows so far, so every message has one set of columns
+    writer.write(dates[1:], [('A', 'p'), ('B', 'p')], np.array([[2.0, 3.0]]))
+    assert [json.loads(payload) for _, payload, _ in client.messages] == [
+        {'time': [1325376000], 'A-p': [1.0]}]
+    writer.close()
+    assert json.loads(client.messages[1][1]) == {'time': [1325376900], 'A-p': [2.0], 'B-p': [3.0]}
+
+
+def test_msgpack_encoding():
+    msgpack = pytest.importorskip('msgpack')
+    client = FakeClient()
+    writer = result_writers.MQTTWriter(None, 't', encoding='msgpack', client=client)
+    writer.write(np.array(['2012-01-01T00:00:00'], dtype='datetime64[s]'), [('A', 'p')],
+                 np.array([[1.0]]))
+    writer.close()
+    assert msgpack.unpackb(client.messages[0][1]) == {'time': [1325376000], 'A-p': [1.0]}
+
+
+def test_changes_only_leaves_the_live_outputs_alone(tmp_path):
+    client = FakeClient()
+    output = tmp_path / 'results.csv'
+    collector = Collector()
+    collector.init('Collector-0', 1, '2012-01-01 00:00:00', dict(RESULTS_SHOW, write2csv=True),
+                   str(output), mqtt_client=client, mqtt_topic='t', mqtt_encoding='json',
+                   changes_only=True)
+    collector.create(1, 'Monitor')
+    for time in range(0, 4 * 900, 900):
+        collector.step(time, {'Monitor': {'p': {'A': 1.0}, 'q': {'A': time / 900}}}, None)
+        # Every step right away, with all values
+        payload = json.loads(client.messages[-1][1])
+        assert payload == {'time': [1325376000 + time], 'A-p': [1.0], 'A-q': [time / 900]}
+    collector.finalize()
+
+    assert len(client.messages) == 4
+    # The csv only gets the changes, and the last step in full
+    assert output.read_text().splitlines() == [
+        'date,A-p,A-q', '2012-01-01 00:00:00,1.0,0.0', '2012-01-01 00:15:00,,1.0',
+        '2012-01-01 00:30:00,,2.0', '2012-01-01 00:45:00,1.0,3.0']
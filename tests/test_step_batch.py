@@ -0,0 +1,326 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Models.result_writers as result_writers
+from Models.collector import Collector
+from Models.result_writers import StepBatch
+
+# The input shapes the outputs had to handle before the shared flattening:
+# floats, ints, bools, None, text, numpy scalars, lists and several sources
+# per attribute
+STEPS = [
+    {'p': {'PV-0.pv_0': 1.5, 'PV-0.pv_1': np.float64(2.25)},
+     'soc': {'Battery-0.b_0': 50, 'Battery-0.b_1': 20},
+     'on': {'Battery-0.b_0': True, 'Battery-0.b_1': False},
+     'mode': {'Ctrl-0.c_0': 'charge'},
+     'missing': {'Ctrl-0.c_0': None}},
+    {'p': {'PV-0.pv_0': 1 / 3, 'PV-0.pv_1': np.float64(0.0)},
+     'soc': {'Battery-0.b_0': 51, 'Battery-0.b_1': 19},
+     'on': {'Battery-0.b_0': False, 'Battery-0.b_1': False},
+     'mode': {'Ctrl-0.c_0': 'idle'},
+     'missing': {'Ctrl-0.c_0': None}},
+]
+NUMPY_STEP = {'p': {'PV-0.pv_0': np.float32(0.5), 'PV-0.pv_1': np.float64(1.0)},
+              'soc': {'Battery-0.b_0': np.int64(7), 'Battery-0.b_1': np.int32(8)},
+              'on': {'Battery-0.b_0': np.bool_(True), 'Battery-0.b_1': False},
+              'mode': {'Ctrl-0.c_0': [1.0, 2.0]},
+              'missing': {'Ctrl-0.c_0': None}}
+
+
+def test_from_inputs_floats():
+    batch = StepBatch.from_inputs({'p': {'A': 1.0, 'B': np.float64(2.0)}, 'q': {'A': 3.5}})
+    assert batch.keys == [('A', 'p'), ('B', 'p'), ('A', 'q')]
+    assert batch.values.dtype == np.float64
+    np.testing.assert_array_equal(batch.values, [1.0, 2.0, 3.5])
+    assert batch.objects == {} and batch.numeric
+    assert [type(value) for value in batch.to_python()] == [float, float, float]
+
+
+def test_from_inputs_mixed():
+    batch = StepBatch.from_inputs(STEPS[0])
+    assert batch.keys == [('PV-0.pv_0', 'p'), ('PV-0.pv_1', 'p'), ('Battery-0.b_0', 'soc'),
+                          ('Battery-0.b_1', 'soc'), ('Battery-0.b_0', 'on'),
+                          ('Battery-0.b_1', 'on'), ('Ctrl-0.c_0', 'mode'),
+                          ('Ctrl-0.c_0', 'missing')]
+    np.testing.assert_array_equal(batch.values, [1.5, 2.25, 50, 20, 1, 0, np.nan, np.nan])
+    assert not batch.numeric
+    values = batch.to_python()
+    assert values == [1.5, 2.25, 50, 20, True, False, 'charge', None]
+    assert [type(value) for value in values] == [float, float, int, int, bool, bool, str,
+                                                 type(None)]
+
+
+def test_from_inputs_numpy_scalars_and_lists():
+    batch = StepBatch.from_inputs(NUMPY_STEP)
+    values = batch.to_python()
+    assert values == [0.5, 1.0, 7, 8, True, False, [1.0, 2.0], None]
+    assert [type(value) for value in values] == [float, float, int, int, bool, bool, list,
+                                                 type(None)]
+    np.testing.assert_array_equal(batch.values, [0.5, 1.0, 7, 8, 1, 0, np.nan, np.nan])
+    assert not batch.numeric
+
+
+def test_from_inputs_lists_of_one_length():
+    # np.array would make a matrix of these
+    batch = StepBatch.from_inputs({'bids': {'A': [1.0, 2.0], 'B': [3.0, 4.0]}})
+    assert batch.values.shape == (2,)
+    np.testing.assert_array_equal(batch.values, [np.nan, np.nan])
+    assert batch.to_python() == [[1.0, 2.0], [3.0, 4.0]]
+    assert not batch.numeric
+    assert batch.row().tolist() == [[[1.0, 2.0], [3.0, 4.0]]]
+
+
+def test_from_inputs_numbers_only_is_numeric():
+    batch = StepBatch.from_inputs({'a': {'A': 1, 'B': None, 'C': np.int32(2), 'D': True}})
+    assert batch.numeric
+    np.testing.assert_array_equal(batch.values, [1, np.nan, 2, 1])
+    assert batch.to_python() == [1, None, 2, True]
+
+
+def test_text_is_not_a_number():
+    batch = StepBatch.from_inputs({'a': {'A': '1.5', 'B': 2.0}})
+    np.testing.assert_array_equal(batch.values, [np.nan, 2.0])
+    assert batch.to_python() == ['1.5', 2.0]
+
+
+def test_from_inputs_several_entities():
+    batch = StepBatch.from_inputs({'p': {'A': 1.0}}, {'p': {'B': 2.0}, 'q': {'A': 'x'}})
+    assert batch.keys == [('A', 'p'), ('B', 'p'), ('A', 'q')]
+    assert batch.by_source() == {'A': {'p': 1.0, 'q': 'x'}, 'B': {'p': 2.0}}
+
+
+def test_empty():
+    batch = StepBatch.from_inputs({})
+    assert len(batch) == 0 and batch.numeric
+    assert batch.by_source() == {}
+    assert batch.row().shape == (1, 0)
+
+
+def test_select():
+    batch = StepBatch.from_inputs(STEPS[0])
+    part = batch.select([0, 2, 6])
+    assert part.keys == [('PV-0.pv_0', 'p'), ('Battery-0.b_0', 'soc'), ('Ctrl-0.c_0', 'mode')]
+    assert part.to_python() == [1.5, 50, 'charge']
+    assert not part.numeric
+    assert batch.select([0, 2]).numeric
+
+
+def test_row():
+    assert StepBatch.from_inputs({'p': {'A': 1.0}}).row().dtype == np.float64
+    row = StepBatch.from_inputs(STEPS[0]).row()
+    assert row.dtype == object and row.shape == (1, 8)
+    assert row[0, :7].tolist() == [1.5, 2.25, 50, 20, True, False, 'charge']
+    assert np.isnan(row[0, 7])
+
+
+def test_result_buffer_keeps_types():
+    buffer = result_writers.ResultBuffer(4)
+    buffer.append(0, StepBatch.from_inputs({'p': {'A': 1.0}, 'n': {'A': 2}, 'on': {'A': True}}))
+    buffer.append(1, StepBatch.from_inputs({'p': {'A': 1.5}, 'n': {'A': None}, 'on': {'A': False},
+                                            'p2': {'B': 3.0}}))
+    times, columns, block = buffer.take()
+    assert times.tolist() == [0, 1]
+    assert columns == [('A', 'p'), ('A', 'n'), ('A', 'on'), ('B', 'p2')]
+    assert block[0, :3].tolist() == [1.0, 2, True]
+    assert [type(value) for value in block[0, :3]] == [float, int, bool]
+    assert np.isnan(block[1, 1]) and block[1, 2] is False
+    assert np.isnan(block[0, 3]) and block[1, 3] == 3.0
+
+
+def test_recording_rules_filter():
+    rules = result_writers.RecordingRules([{'entity': 'Battery-*', 'attr': 'soc', 'every': 1800},
+                                           {'entity': 'PV-*'}])
+    batch = StepBatch.from_inputs(STEPS[0])
+    assert rules.filter(0, batch).keys == [('PV-0.pv_0', 'p'), ('PV-0.pv_1', 'p'),
+                                           ('Battery-0.b_0', 'soc'), ('Battery-0.b_1', 'soc')]
+    assert rules.filter(900, batch).to_python() == [1.5, 2.25]
+
+
+# The outputs compared to the flattening each of them did before
+
+
+def legacy_collector_csv(steps, path):
+    # Collector.step before the result buffer: one DataFrame per step
+    for time, data in enumerate(steps):
+        df_dict = {'date': pd.Timestamp('2012-01-01') + pd.Timedelta(time * 900, unit='seconds')}
+        for attr, values in data.items():
+            for src, value in values.items():
+                df_dict[f'{src}-{attr}'] = [value]
+        df = pd.DataFrame.from_dict(df_dict).set_index('date')
+        df.to_csv(path, mode='w' if time == 0 else 'a', header=time == 0)
+
+
+def test_collector_csv_matches_legacy(tmp_path):
+    steps = STEPS + [NUMPY_STEP]
+    legacy = tmp_path / 'legacy.csv'
+    legacy_collector_csv(steps, legacy)
+
+    output = tmp_path / 'results.csv'
+    collector = Collector()
+    collector.init('Collector-0', 900, '2012-01-01 00:00:00',
+                   {'write2csv': True, 'dashboard_show': False, 'database': False}, str(output),
+                   flush_steps=2, step_size=1)
+    collector.create(1, 'Monitor')
+    for time, data in enumerate(steps):
+        collector.step(time, {'Monitor': data}, None)
+    collector.finalize()
+
+    expected = pd.read_csv(legacy, dtype=str, keep_default_na=False)
+    result = pd.read_csv(output, dtype=str, keep_default_na=False)
+    # The legacy output wrote midnight without its time
+    expected['date'] = [pd.Timestamp(date) for date in expected['date']]
+    result['date'] = [pd.Timestamp(date) for date in result['date']]
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def legacy_sql_rows(inputs):
+    # mosaik_sql.step and insert_values before the shared flattening
+    attr_dict = {}
+    for sink_id, data in inputs.items():
+        for attr, data2 in data.items():
+            for src_id, value in data2.items():
+                attr_dict.setdefault(src_id, []).append((attr, value))
+    rows = {}
+    for src_id, values in attr_dict.items():
+        row = []
+        for attr, value in values:
+            if value.__class__.__name__.lower() == 'float64':
+                value = float(value)
+            row.append(value)
+        rows[src_id] = row
+    return rows
+
+
+@pytest.mark.parametrize('create_tables', ['multi', 'single'])
+def test_mosaik_sql_matches_legacy(tmp_path, create_tables):
+    mosaik_sql = pytest.importorskip('Models.mosaik_sql')
+    db = str(tmp_path / 'sql.db')
+    sim = mosaik_sql.SQL()
+    sim.init('SQL-0', 900, '2012-01-01 00:00:00', None, None, None, db, create_tables, 'results',
+             backend='sqlite')
+    sim.create(1, 'mosaik_sql')
+    for i, data in enumerate(STEPS):
+        sim.step(i * 900, {'mosaik_sql_0': data})
+    sim.finalize()
+
+    conn = sqlite3.connect(db)
+    if create_tables == 'multi':
+        for i, data in enumerate(STEPS):
+            ts = str(pd.Timestamp('2012-01-01') + pd.Timedelta(i * 900, unit='seconds'))
+            for src_id, row in legacy_sql_rows({'mosaik_sql_0': data}).items():
+                stored = conn.execute('SELECT * FROM `%s` WHERE ts = ?' % src_id, (ts,)).fetchall()
+                assert stored == [tuple([ts] + row)]
+        # Column types from the first step, as before
+        schema = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'Battery-0.b_0'").fetchone()
+        assert '`soc` INT' in schema[0] and '`on` INT' in schema[0]
+    else:
+        expected = []
+        for i, data in enumerate(STEPS):
+            ts = str(pd.Timestamp('2012-01-01') + pd.Timedelta(i * 900, unit='seconds'))
+            for sink_id, values in {'mosaik_sql_0': data}.items():
+                for attr, sources in values.items():
+                    for src_id, value in sources.items():
+                        expected.append((src_id, attr, ts, str(value)))
+        stored = conn.execute('SELECT src, valueName, ts, value FROM results ORDER BY id').fetchall()
+        assert sorted(stored) == sorted(expected)
+    conn.close()
+
+
+def test_mosaik_sql_numpy_scalars(tmp_path):
+    mosaik_sql = pytest.importorskip('Models.mosaik_sql')
+    db = str(tmp_path / 'sql.db')
+    sim = mosaik_sql.SQL()
+    sim.init('SQL-0', 900, '2012-01-01 00:00:00', None, None, None, db, 'multi', backend='sqlite')
+    sim.create(1, 'mosaik_sql')
+    data = {'soc': {'B': np.int64(7)}, 'p': {'B': np.float32(0.5)}, 'on': {'B': np.bool_(True)}}
+    sim.step(0, {'mosaik_sql_0': data})
+    sim.finalize()
+    conn = sqlite3.connect(db)
+    assert conn.execute('SELECT soc, p, `on` FROM `B`').fetchall() == [(7, 0.5, 1)]
+    conn.close()
+
+
+class FakeCursor:
+    """Records the csv files that LOAD DATA would load."""
+
+    def __init__(self):
+        self.loaded = []
+
+    def execute(self, query):
+        path = query.split("'")[1]
+        with open(path) as f:
+            self.loaded.append(f.read().splitlines())
+
+
+def test_mosaik_sql_bulk_load_writes_bools_as_ints():
+    mosaik_sql = pytest.importorskip('Models.mosaik_sql')
+    sim = mosaik_sql.SQL()
+    sim.create_tables = 'multi'
+    sim._columns = {'B': ['soc', 'on', 'mode']}
+    sim._cur = FakeCursor()
+    sim._load_data('B', [('2012-01-01 00:00:00', 50, True, None),
+                         ('2012-01-01 00:15:00', 51, False, 'idle')])
+    assert sim._cur.loaded == [['2012-01-01 00:00:00,50,1,\\N', '2012-01-01 00:15:00,51,0,idle']]
+
+
+class FakeWriteApi:
+    def __init__(self):
+        self.records = []
+
+    def write(self, bucket, record):
+        self.records.append((bucket, record))
+
+
+def legacy_influx_points(influx, data, measurement, timestamp):
+    # influxdbwriter.Simulator.step before the shared flattening: one point
+    # per attribute and source
+    points = []
+    for attr, src_ids in data.items():
+        for src_id, val in src_ids.items():
+            if isinstance(val, np.generic):
+                val = val.item()
+            src_sim, src_entity = src_id.split('.')
+            points.append(influx.Point(measurement).tag('src_sim', src_sim)
+                          .tag('src_entity', src_entity).field(attr, val).time(timestamp))
+    return points
+
+
+def merged_fields(points):
+    # {(series, time): fields} of the line protocol of *points*
+    merged = {}
+    for point in points:
+        line = point.to_line_protocol()
+        if not line:
+            # A point without any value is not written
+            continue
+        series, fields, time = line.split(' ')
+        merged.setdefault((series, time), set()).update(fields.split(','))
+    return merged
+
+
+# Lists were never valid Influx fields
+@pytest.mark.parametrize('data', STEPS + [dict(NUMPY_STEP, mode={'Ctrl-0.c_0': 'idle'})],
+                         ids=['step0', 'step1', 'numpy'])
+def test_influx_matches_legacy(data):
+    influx = pytest.importorskip('influxdb_client')
+    influxdbwriter = pytest.importorskip('Models.influxdbwriter')
+    data = {attr: {src.replace('-0.', '.'): value for src, value in sources.items()}
+            for attr, sources in data.items()}
+    sim = influxdbwriter.Simulator()
+    sim.init('Influx-0', 1, start_date='2012-01-01 00:00:00+01:00')
+    sim._influx_writer = FakeWriteApi()
+    sim._bucket = 'bucket'
+    sim._measurement = 'results'
+    sim.step(0, {'Database': data}, None)
+
+    (bucket, records), = sim._influx_writer.records
+    assert bucket == 'bucket'
+    # One point per source now, with the fields the points per attribute had
+    assert len(records) == len({src for sources in data.values() for src in sources})
+    expected = legacy_influx_points(influx, data, 'results',
+                                    sim._time_converter.isoformat_from_step(0))
+    assert merged_fields(records) == merged_fields(expected)
+